@@ -0,0 +1,20 @@
+import json
+import os
+import threading
+
+
+# Function to write data as JSON to a file atomically, concurrent readers never
+# see half a file. The temp file is unique per process and thread, so two tools
+# (e.g. a cron sweep next to a service) can write the same file at once.
+def atomic_write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,10 @@
+import os
+
+
+# Function to get the directory of a named cache, the directory is created if missing.
+# All caches live under $PYTOOLS_CACHE_DIR, default is "_tmp/.cache".
+def cache_dir(name):
+    root = os.environ.get("PYTOOLS_CACHE_DIR", os.path.join("_tmp", ".cache"))
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
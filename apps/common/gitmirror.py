@@ -0,0 +1,71 @@
+import fcntl
+import os
+import subprocess
+
+from apps.common.cachedir import cache_dir
+
+
+# Function to get the path of the bare mirror of an upstream repo, e.g. "stolostron/ocm"
+def mirror_path(repo):
+    owner, name = repo.split("/")
+    return os.path.join(cache_dir("git"), owner, f"{name}.git")
+
+
+# Function to create or incrementally update the bare mirror of an upstream repo,
+# returns its absolute path. The mirror only keeps the branches. A lock file
+# serializes the tools updating the same mirror at once.
+# run is the function to run git with, e.g. apps.konflux.workers.run.
+def update_mirror(repo, url=None, run=subprocess.run):
+    path = os.path.abspath(mirror_path(repo))
+    url = url or f"git@github.com:{repo}.git"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(os.path.join(path, "HEAD")):
+            print(f"Creating the mirror of {repo} in {path}...")
+            run(["git", "init", "--bare", "--quiet", path], check=True)
+            run(["git", "-C", path, "remote", "add", "origin", url], check=True)
+            run(
+                [
+                    "git",
+                    "-C",
+                    path,
+                    "config",
+                    "remote.origin.fetch",
+                    "+refs/heads/*:refs/heads/*",
+                ],
+                check=True,
+            )
+        else:
+            print(f"Updating the mirror of {repo}...")
+        run(["git", "-C", path, "fetch", "--prune", "--no-tags", "origin"], check=True)
+    return path
+
+
+# Function to clone a workspace with the objects of the mirror, only the objects
+# missing from the mirror (e.g. the branches of a fork) are downloaded. With
+# --dissociate the objects are copied into the workspace, so it does not break
+# when the cache with the mirror is deleted.
+def clone_with_reference(url, repo_dir, mirror, run=subprocess.run):
+    run(
+        ["git", "clone", "--reference", mirror, "--dissociate", url, repo_dir],
+        check=True,
+    )
+
+
+# Function to update the remote-tracking branches of a workspace from the mirror
+# instead of the network, e.g. upstream/main. The remote is still used to push.
+def fetch_from_mirror(repo_dir, mirror, remote="upstream", run=subprocess.run):
+    run(
+        [
+            "git",
+            "-C",
+            repo_dir,
+            "fetch",
+            "--prune",
+            "--no-tags",
+            mirror,
+            f"+refs/heads/*:refs/remotes/{remote}/*",
+        ],
+        check=True,
+    )
@@ -0,0 +1,45 @@
+import subprocess
+
+
+# Function to clone a narrow workspace: a blobless partial clone of the default
+# branch only, with just the given paths checked out. The blobs of other commits
+# are downloaded on demand when they are checked out.
+# run is the function to run git with, e.g. apps.konflux.workers.run.
+def narrow_clone(url, repo_dir, paths=(".tekton",), run=subprocess.run):
+    run(
+        [
+            "git",
+            "clone",
+            "--filter=blob:none",
+            "--sparse",
+            "--single-branch",
+            "--no-tags",
+            url,
+            repo_dir,
+        ],
+        check=True,
+    )
+    run(["git", "-C", repo_dir, "sparse-checkout", "set", *paths], check=True)
+
+
+# Function to fetch only the given branches of a remote into its remote-tracking
+# branches, without tags and blobs. The remote becomes a promisor remote, so the
+# blobs only it has can be downloaded on demand too.
+def narrow_fetch(repo_dir, remote, branches, run=subprocess.run):
+    refspecs = [
+        f"+refs/heads/{branch}:refs/remotes/{remote}/{branch}"
+        for branch in dict.fromkeys(branches)
+    ]
+    run(
+        [
+            "git",
+            "-C",
+            repo_dir,
+            "fetch",
+            "--no-tags",
+            "--filter=blob:none",
+            remote,
+            *refspecs,
+        ],
+        check=True,
+    )
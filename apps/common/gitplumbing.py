@@ -0,0 +1,199 @@
+import hashlib
+import subprocess
+
+
+# Function to run a git command in a repo and return its stdout as bytes
+def git(repo_dir, *args, input=None):
+    result = subprocess.run(
+        ["git", "-C", repo_dir, *args], input=input, capture_output=True, check=True
+    )
+    return result.stdout
+
+
+# Function to compute the object id git gives to a blob with this content,
+# without running git
+def blob_sha(content):
+    header = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+# Function to get the commit id of a revision
+def rev_parse(repo_dir, rev):
+    return git(repo_dir, "rev-parse", "--verify", f"{rev}^{{commit}}").decode().strip()
+
+
+# Function to tell what rebasing a branch onto another revision would do, without
+# touching the index or the worktree. Returns "up to date" if the branch already
+# contains onto, "fast-forward" if the branch has no commits of its own, "conflict"
+# if merging the two conflicts, else "rebase". The merge is done in memory with
+# git merge-tree, so a rebase whose commits only conflict with each other is not
+# detected.
+def rebase_state(repo_dir, branch, onto):
+    if int(git(repo_dir, "rev-list", "--count", f"{branch}..{onto}")) == 0:
+        return "up to date"
+    if int(git(repo_dir, "rev-list", "--count", f"{onto}..{branch}")) == 0:
+        return "fast-forward"
+    result = subprocess.run(
+        [
+            "git",
+            "-C",
+            repo_dir,
+            "merge-tree",
+            "--write-tree",
+            "--no-messages",
+            onto,
+            branch,
+        ],
+        capture_output=True,
+    )
+    # merge-tree exits with 1 when there are conflicts, and with another code on errors
+    if result.returncode == 1:
+        return "conflict"
+    result.check_returncode()
+    return "rebase"
+
+
+# Function to list a tree, recursively or not, limited to the given paths.
+# Returns {path: (mode, type, object id)}.
+def ls_tree(repo_dir, tree, paths=(), recursive=False):
+    args = ["ls-tree", "-z"]
+    if recursive:
+        args.append("-r")
+    output = git(repo_dir, *args, tree, "--", *paths)
+    entries = {}
+    for line in output.decode().split("\0"):
+        if not line:
+            continue
+        info, path = line.split("\t", 1)
+        mode, kind, sha = info.split()
+        entries[path] = (mode, kind, sha)
+    return entries
+
+
+# A long-lived `git cat-file --batch` process to read many objects of a repo,
+# e.g. the .tekton folders of several branches, without a checkout
+class CatFileBatch:
+    def __init__(self, repo_dir):
+        self.process = subprocess.Popen(
+            ["git", "-C", repo_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Function to read an object by name (e.g. a sha or "main:.tekton"),
+    # returns its type and content, or (None, None) if it does not exist
+    def read(self, name):
+        self.process.stdin.write(f"{name}\n".encode())
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None, None
+        kind, size = header[1].decode(), int(header[2])
+        content = self.process.stdout.read(size)
+        # Every object is followed by a newline
+        self.process.stdout.read(1)
+        return kind, content
+
+    # Function to list a tree recursively, returns {path: (mode, object id)} of
+    # its blobs, or None if the tree does not exist
+    def list_tree(self, name, prefix=""):
+        kind, content = self.read(name)
+        if kind != "tree":
+            return None
+        entries = {}
+        offset = 0
+        while offset < len(content):
+            space = content.index(b" ", offset)
+            nul = content.index(b"\0", space)
+            mode = content[offset:space].decode()
+            path = prefix + content[space + 1 : nul].decode()
+            sha = content[nul + 1 : nul + 21].hex()
+            offset = nul + 21
+            if mode == "40000":
+                entries.update(self.list_tree(sha, f"{path}/"))
+            else:
+                entries[path] = (mode, sha)
+        return entries
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+# Function to write a blob into the object database, returns its object id
+def write_blob(repo_dir, content):
+    return git(repo_dir, "hash-object", "-w", "--stdin", input=content).decode().strip()
+
+
+# Function to write a tree with the given changes applied to another tree (None
+# for an empty one). changes is {path: content bytes, or None to delete the file}.
+# Only the trees along the changed paths are read and rewritten, the rest of the
+# repo is reused as it is. Returns the object id of the new tree, or None if it is empty.
+def write_tree(repo_dir, tree, changes):
+    entries = ls_tree(repo_dir, tree) if tree else {}
+    children = {}
+    for path, content in changes.items():
+        name, _, rest = path.partition("/")
+        if rest:
+            children.setdefault(name, {})[rest] = content
+        elif content is None:
+            entries.pop(name, None)
+        elif name not in entries or entries[name][2] != blob_sha(content):
+            # Only blobs whose content hash changed are written
+            mode = entries[name][0] if name in entries else "100644"
+            entries[name] = (mode, "blob", write_blob(repo_dir, content))
+    for name, child_changes in children.items():
+        child = entries.get(name)
+        subtree = child[2] if child and child[1] == "tree" else None
+        sha = write_tree(repo_dir, subtree, child_changes)
+        if sha:
+            entries[name] = ("040000", "tree", sha)
+        else:
+            entries.pop(name, None)
+    if not entries:
+        return None
+    lines = "".join(
+        f"{mode} {kind} {sha}\t{name}\0" for name, (mode, kind, sha) in entries.items()
+    )
+    return git(repo_dir, "mktree", "-z", input=lines.encode()).decode().strip()
+
+
+# Function to get the "Signed-off-by" trailer of the committer, the same one git commit --signoff adds
+def signoff(repo_dir):
+    ident = git(repo_dir, "var", "GIT_COMMITTER_IDENT").decode().strip()
+    # The ident ends with the timestamp and the timezone
+    return f"Signed-off-by: {ident.rsplit(' ', 2)[0]}"
+
+
+# Function to commit the changes on top of a parent commit without touching the
+# index or the worktree, returns the object id of the new commit
+def commit_changes(repo_dir, parent, changes, message):
+    tree = write_tree(repo_dir, f"{parent}^{{tree}}", changes)
+    message = f"{message}\n\n{signoff(repo_dir)}\n"
+    return (
+        git(
+            repo_dir,
+            "commit-tree",
+            tree,
+            "-p",
+            parent,
+            "-F",
+            "-",
+            input=message.encode(),
+        )
+        .decode()
+        .strip()
+    )
+
+
+# Function to move the checked out branch from old to new commit. Only the files
+# that differ between the two commits are updated in the index and the worktree.
+def advance_branch(repo_dir, branch, old, new):
+    git(repo_dir, "read-tree", "-m", "-u", old, new)
+    git(repo_dir, "update-ref", f"refs/heads/{branch}", new, old)
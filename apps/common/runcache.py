@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+import time
+
+from apps.common.atomicwrite import atomic_write_json
+from apps.common.cachedir import cache_dir
+
+
+# Function to get a stable digest of a JSON-serializable config
+def config_digest(config):
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+# A record of the outcome of the last successful run of a tool on a repo, keyed
+# by (tool, repo, upstream SHA, config digest). A run can be skipped when the
+# upstream has not moved and the parameters of the tool did not change. The
+# full key and config are stored with the outcome and compared on lookup, so a
+# digest collision or a changed config is a miss, never a wrong hit.
+class RunCache:
+    def __init__(self, tool, directory=None):
+        self.tool = tool
+        self.directory = directory or cache_dir(os.path.join("runs", tool))
+
+    def _entry_key(self, repo, upstream_sha, config):
+        return {
+            "tool": self.tool,
+            "repo": repo,
+            "upstream_sha": upstream_sha,
+            "config": json.loads(json.dumps(config, sort_keys=True, default=str)),
+        }
+
+    def _path(self, key):
+        digest = config_digest(key)
+        return os.path.join(self.directory, f"{digest}.json")
+
+    # Function to get the outcome recorded for the repo at the upstream SHA with
+    # the same config, returns None if there is none
+    def get(self, repo, upstream_sha, config):
+        if not upstream_sha:
+            return None
+        key = self._entry_key(repo, upstream_sha, config)
+        try:
+            with open(self._path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+        return entry["outcome"]
+
+    # Function to record the outcome of a successful run, the write is atomic
+    def put(self, repo, upstream_sha, config, outcome):
+        if not upstream_sha:
+            return
+        key = self._entry_key(repo, upstream_sha, config)
+        atomic_write_json(
+            self._path(key),
+            {"key": key, "outcome": outcome, "recorded_at": time.time()},
+        )
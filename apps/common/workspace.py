@@ -0,0 +1,50 @@
+import os
+import subprocess
+
+from apps.common.gitmirror import clone_with_reference, update_mirror
+from apps.common.gitnarrow import narrow_clone
+
+
+# Function to check if the "upstream" remote exists, if not, add it
+def check_upstream_remote(repo_dir, upstream_url, run=subprocess.run):
+    try:
+        # Check if the upstream remote already exists
+        result = run(
+            ["git", "-C", repo_dir, "remote", "get-url", "upstream"],
+            capture_output=True,
+            text=True,
+        )
+
+        # If the upstream remote does not exist, the command will fail
+        if result.returncode != 0:
+            print(f"Upstream remote not found. Adding upstream remote: {upstream_url}")
+            run(
+                ["git", "-C", repo_dir, "remote", "add", "upstream", upstream_url],
+                check=True,
+            )
+        else:
+            print("Upstream remote already exists.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error checking or adding upstream remote: {e}")
+
+
+# Function to clone the workspace of a repo from the forked repository if it does
+# not exist yet, and add the original repository as the upstream remote. Returns
+# the path of the mirror of the repo, or None for a narrow workspace: it only has
+# the .tekton folder and does not use the mirror, the caller fetches the refs it needs.
+# run is the function to run git with, e.g. apps.konflux.workers.run.
+def clone_workspace(repo, fork_user, repo_dir, narrow=False, run=subprocess.run):
+    # Construct the URL for the forked repository
+    forked_repo_url = f"git@github.com:{fork_user}/{repo.split('/')[1]}.git"
+    mirror = None if narrow else update_mirror(repo, run=run)
+    if not os.path.exists(repo_dir):
+        print(f"Cloning {forked_repo_url} into {repo_dir}...")
+        if narrow:
+            narrow_clone(forked_repo_url, repo_dir, run=run)
+        else:
+            clone_with_reference(forked_repo_url, repo_dir, mirror, run=run)
+
+    # Add the original repository as the upstream remote
+    original_repo_url = f"git@github.com:{repo}.git"
+    check_upstream_remote(repo_dir, original_repo_url, run=run)
+    return mirror
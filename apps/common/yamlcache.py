@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from apps.common.cachedir import cache_dir
+
+DEFAULT_MAX_ENTRIES = 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS canonical (
+    digest TEXT PRIMARY KEY,
+    used_at REAL NOT NULL
+)
+"""
+
+
+# A persistent set of the YAML contents known to be canonically formatted, i.e.
+# a ruamel.yaml load and dump gives them back unchanged. Such files can skip the
+# slow round trip. The formatter settings are part of the digest of a content,
+# so changing the width or the indents never matches the old entries. The least
+# recently used entries are dropped once there are more than max_entries.
+class CanonicalYAMLCache:
+    def __init__(self, settings, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.salt = json.dumps(settings, sort_keys=True)
+        self.path = path or os.path.join(cache_dir("yaml"), "canonical.sqlite")
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(SCHEMA)
+
+    def _digest(self, content):
+        return hashlib.sha256(f"{self.salt}\0{content}".encode()).hexdigest()
+
+    # Function to tell if a content is known to be canonical under the settings
+    def is_canonical(self, content):
+        digest = self._digest(content)
+        with self._lock, self._db:
+            updated = self._db.execute(
+                "UPDATE canonical SET used_at = ? WHERE digest = ?",
+                (time.time(), digest),
+            )
+            return updated.rowcount > 0
+
+    # Function to record a content as canonical under the settings
+    def add(self, content):
+        digest = self._digest(content)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO canonical VALUES (?, ?)", (digest, time.time())
+            )
+            (count,) = self._db.execute("SELECT COUNT(*) FROM canonical").fetchone()
+            if count > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM canonical WHERE digest IN "
+                    "(SELECT digest FROM canonical ORDER BY used_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
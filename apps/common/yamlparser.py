@@ -0,0 +1,25 @@
+import threading
+
+from ruamel.yaml import YAML
+
+# YAML formatter settings of the tekton files
+YAML_SETTINGS = {
+    "preserve_quotes": True,
+    "width": 256,
+    "indent": {"mapping": 2, "sequence": 2, "offset": 0},
+}
+# YAML parsers, one per thread since a parser can not be shared between threads
+_yaml_local = threading.local()
+
+
+# Function to get the YAML parser of the current thread
+def get_yaml():
+    yaml = getattr(_yaml_local, "yaml", None)
+    if yaml is None:
+        # Initialize YAML parser
+        yaml = YAML()
+        yaml.preserve_quotes = YAML_SETTINGS["preserve_quotes"]
+        yaml.width = YAML_SETTINGS["width"]
+        yaml.indent(**YAML_SETTINGS["indent"])
+        _yaml_local.yaml = yaml
+    return yaml
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import subprocess
+import threading
+from urllib.parse import urlencode
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # fall back to the gh command
+    requests = None
+
+from apps.konflux.httpcache import HTTPCache, cache_key
+from apps.konflux.ratelimit import RateLimitScheduler
+
+API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+# How many times a request rejected by a rate limit is retried
+MAX_RETRIES = 3
+
+
+class GitHubError(Exception):
+    # status is the HTTP status of a failed request if known, errors and data
+    # are the GraphQL errors and the partial data of a failed query
+    def __init__(self, message, status=None, errors=None, data=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+        self.data = data
+
+
+# Function to tell if a request mutates data, GraphQL mutations are sent with POST
+# like queries so the query text decides
+def is_write(method, body=None):
+    if method == "GET":
+        return False
+    if isinstance(body, dict) and "query" in body:
+        return body["query"].lstrip().startswith("mutation")
+    return True
+
+
+# Function to get the rate limit resource a request is counted against
+def rate_limit_resource(path):
+    path = path.lstrip("/")
+    if path == "graphql":
+        return "graphql"
+    if path.startswith("search/"):
+        return "search"
+    return "core"
+
+
+# Function to read the GitHub token once, from the environment or from the gh command
+def read_token():
+    for env in ("GH_TOKEN", "GITHUB_TOKEN"):
+        if os.environ.get(env):
+            return os.environ[env]
+    try:
+        result = subprocess.run(
+            ["gh", "auth", "token"], capture_output=True, text=True, check=True
+        )
+        return result.stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# A GitHub API client sharing one keep-alive connection pool between all calls.
+# If there is no token or no requests package, every call goes through `gh api`.
+class GitHubClient:
+    def __init__(self, token=None, pool_size=16, cache=None):
+        self.session = None
+        self.cache = cache
+        self.scheduler = RateLimitScheduler()
+        if token and requests:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.headers.update(
+                {
+                    "Authorization": f"Bearer {token}",
+                    "Accept": "application/vnd.github+json",
+                    "X-GitHub-Api-Version": "2022-11-28",
+                }
+            )
+        else:
+            print("No GitHub token or requests package found, using the gh command.")
+
+    # Function to send a request to the REST API and return the decoded JSON response.
+    # cost is how many writes the request makes, e.g. the mutations of a GraphQL batch.
+    def request(self, method, path, params=None, body=None, cost=1):
+        if self.session is None:
+            return self._gh_request(method, path, params, body, cost)
+        response = self._send(method, path, params, body, cost=cost)
+        if response.status_code >= 400:
+            raise GitHubError(
+                f"{method} {path} failed with {response.status_code}: {response.text}",
+                status=response.status_code,
+            )
+        if not response.content:
+            return None
+        return response.json()
+
+    # Function to send a request paced by the rate limit scheduler, requests
+    # rejected by a rate limit are retried
+    def _send(self, method, path, params=None, body=None, headers=None, cost=1):
+        write = is_write(method, body)
+        resource = rate_limit_resource(path)
+        for attempt in range(MAX_RETRIES + 1):
+            self.scheduler.before_request(write, resource, cost)
+            try:
+                response = self.session.request(
+                    method,
+                    f"{API_URL}/{path.lstrip('/')}",
+                    params=params,
+                    json=body,
+                    headers=headers,
+                )
+            except requests.RequestException as e:
+                raise GitHubError(f"{method} {path} failed: {e}") from e
+            wait = self.scheduler.after_response(
+                write, response.status_code, response.headers, response.text
+            )
+            if wait is None or attempt == MAX_RETRIES:
+                return response
+            self.scheduler.wait_retry(write, wait)
+
+    def _gh_request(self, method, path, params=None, body=None, cost=1):
+        # The response headers are not available here, only pace the writes
+        self.scheduler.before_request(is_write(method, body), cost=cost)
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        args = ["gh", "api", "-X", method, path]
+        if body is not None:
+            args += ["--input", "-"]
+        try:
+            result = subprocess.run(
+                args,
+                input=json.dumps(body) if body is not None else None,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            # gh reports the status as "(HTTP 404)"
+            status = re.search(r"HTTP (\d{3})", e.stderr or "")
+            raise GitHubError(
+                f"{method} {path} failed: {e.stderr or e}",
+                status=int(status.group(1)) if status else None,
+            ) from e
+        except OSError as e:
+            raise GitHubError(
+                f"{method} {path} failed, gh is not available: {e}"
+            ) from e
+        if not result.stdout.strip():
+            return None
+        return json.loads(result.stdout)
+
+    def get(self, path, params=None):
+        return self.conditional_get(path, params)[0]
+
+    # Function to send a GET request revalidated against the HTTP cache with
+    # If-None-Match/If-Modified-Since. Returns the body and whether the server
+    # answered 304 Not Modified, 304s do not count against the rate limit.
+    def conditional_get(self, path, params=None):
+        if self.session is None or self.cache is None:
+            return self.request("GET", path, params=params), False
+
+        key = cache_key(f"{API_URL}/{path.lstrip('/')}", params)
+        entry = self.cache.get(key)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self._send("GET", path, params, headers=headers)
+        if response.status_code == 304 and entry:
+            return entry["body"], True
+        if response.status_code >= 400:
+            raise GitHubError(
+                f"GET {path} failed with {response.status_code}: {response.text}",
+                status=response.status_code,
+            )
+        body = response.json() if response.content else None
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(
+                key, {"etag": etag, "last_modified": last_modified, "body": body}
+            )
+        return body, False
+
+    def post(self, path, body):
+        return self.request("POST", path, body=body)
+
+    # Function to run a GraphQL query and return the "data" field of the response
+    def graphql(self, query, variables=None, cost=1):
+        variables = {k: v for k, v in (variables or {}).items() if v is not None}
+        result = self.request(
+            "POST", "graphql", body={"query": query, "variables": variables}, cost=cost
+        )
+        if result.get("errors"):
+            raise GitHubError(
+                f"GraphQL query failed: {result['errors']}",
+                errors=result["errors"],
+                data=result.get("data"),
+            )
+        return result["data"]
+
+
+_client = None
+_client_lock = threading.Lock()
+_cache_enabled = True
+
+
+# Function to turn off the HTTP cache, must be called before the client is created
+def disable_cache():
+    global _cache_enabled
+    _cache_enabled = False
+
+
+# Function to get the client shared by the whole process, the token is read only once
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient(
+                read_token(), cache=HTTPCache() if _cache_enabled else None
+            )
+        return _client
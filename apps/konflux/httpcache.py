@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import threading
+
+from apps.common.atomicwrite import atomic_write_json
+from apps.common.cachedir import cache_dir
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+# Function to compute the cache key of a request from its URL and query parameters
+def cache_key(url, params=None):
+    query = json.dumps(sorted((params or {}).items()), default=str)
+    return hashlib.sha256(f"{url}?{query}".encode()).hexdigest()
+
+
+# An on-disk cache of GitHub responses with their ETag/Last-Modified validators.
+# One JSON file per entry, least recently used entries are evicted once the
+# cache grows over max_bytes.
+class HTTPCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or cache_dir("http")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    # Function to load an entry, returns None if it is not cached
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touch the file so the eviction keeps recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    # Function to store an entry, the write is atomic so concurrent readers never see half a file
+    def put(self, key, entry):
+        atomic_write_json(self._path(key), entry)
+        self._evict()
+
+    # Function to remove the least recently used entries until the cache fits in max_bytes
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, name in sorted(entries):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    return
@@ -0,0 +1,58 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from apps.common.cachedir import cache_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prs (
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    head_sha TEXT NOT NULL,
+    checks TEXT NOT NULL,
+    actions TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (repo, number)
+)
+"""
+
+
+# A local SQLite record of the PRs prreview has handled: the head SHA and check
+# status it last saw, and the actions (retarget, title, cc, lgtm) already taken
+# or found unnecessary for them. The actions are only valid as long as the head
+# SHA and the checks stay the same.
+class ActionLedger:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir("prreview"), "ledger.sqlite")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(SCHEMA)
+
+    # Function to get the actions already handled for a PR at the given head SHA and checks
+    def handled_actions(self, repo, number, head_sha, checks):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT head_sha, checks, actions FROM prs WHERE repo = ? AND number = ?",
+                (repo, number),
+            ).fetchone()
+        if not row or row[0] != head_sha or row[1] != checks:
+            return set()
+        return set(json.loads(row[2]))
+
+    # Function to record the actions handled for a PR at the given head SHA and checks
+    def record(self, repo, number, head_sha, checks, actions):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    repo,
+                    number,
+                    head_sha,
+                    checks,
+                    json.dumps(sorted(actions)),
+                    time.time(),
+                ),
+            )
@@ -2,70 +2,102 @@ import subprocess
 import os
 import click
 import os
-from ruamel.yaml import YAML
-import json
 import re
 
-# Initialize YAML parser
-yaml = YAML()
-yaml.preserve_quotes = True
-yaml.width = 256
-yaml.indent(mapping=2, sequence=2, offset=0)
-
-
-# Function to run gh command and get PRs for a repo
-def get_prs(repo):
-    result = subprocess.run(
-        [
-            "gh",
-            "pr",
-            "list",
-            "--repo",
-            repo,
-            "--json",
-            "title,url,headRefName",
-            "--jq",
-            ".[] | {title, url, headRefName}",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+from apps.common.runcache import RunCache
+from apps.common.workspace import clone_workspace
+from apps.common.yamlparser import get_yaml
+from apps.konflux.ghclient import GitHubError, get_client
+from apps.konflux.migrationrules import compile_rules, migrate_folder
+from apps.konflux.prsearch import (
+    KONFLUX_BOT,
+    build_pr_search_queries,
+    common_title_terms,
+    search_pull_requests,
+)
+from apps.konflux.pushqueue import PushQueue
+from apps.konflux.workers import run, run_grouped
+
+# The titles of the PRs to migrate contain one of these
+title_keywords = [
+    "chore(deps): update konflux references",
+    "Update Konflux references",
+]
+# The PR descriptions of the PRs to migrate contain this
+migration_description = (
+    "tekton-catalog/task-buildah | `0.2` -> `0.3` | :warning:[migration]"
+)
+# The rules to apply to the tekton files, see apps/konflux/migrationrules.py.
+# Remove the JAVA_COMMUNITY_DEPENDENCIES lines with the line before and after them.
+migration_rules = [
+    {
+        "name": "remove JAVA_COMMUNITY_DEPENDENCIES",
+        "pattern": r".*JAVA_COMMUNITY_DEPENDENCIES.*",
+        "before": 1,
+        "after": 1,
+    },
+]
+migration_commit_message = "Migrate task buildah from 0.2 to 0.3"
+
+
+# Function to load the migration, from a rules file if given. The file has a
+# "rules" list, and optionally the "description" of the PRs to migrate and the
+# "commit_message", which default to the ones of the built-in migration.
+def load_migration(rules_file=None):
+    migration = {
+        "description": migration_description,
+        "commit_message": migration_commit_message,
+        "rules": migration_rules,
+    }
+    if rules_file:
+        with open(rules_file, "r") as f:
+            content = get_yaml().load(f) or {}
+        migration.update(
+            {key: content[key] for key in migration if content.get(key) is not None}
+        )
+    migration["compiled_rules"] = compile_rules(migration["rules"])
+    return migration
+
+
+# Function to get the open PRs of the Konflux bot for all repos with one search,
+# filtered on the server by title. The qualifiers do not count in the 256
+# characters of a query, so one "repo:" qualifier per repo fits. The PRs come
+# with their body. Returns {repo: PRs}.
+def get_prs(repos):
+    prs = {repo: [] for repo in repos}
+    queries = build_pr_search_queries(
+        repos,
+        authors=[KONFLUX_BOT],
+        title_terms=common_title_terms(title_keywords),
     )
-    if result.returncode != 0:
-        print(f"Error fetching PRs: {result.stderr}")
-        return []
-    return [pr.strip() for pr in result.stdout.splitlines()]
-
-
-# Function to check if a PR title and description match the criteria
-def check_pr_title_and_description(repo, pr):
+    try:
+        nodes = search_pull_requests(
+            queries, "number title url body headRefName headRefOid"
+        )
+    except GitHubError as e:
+        print(f"Error fetching PRs: {e}")
+        return prs
+    for pr in nodes:
+        repo = pr["repository"]["nameWithOwner"]
+        if repo in prs:
+            prs[repo].append(pr)
+    return prs
+
+
+# Function to check if a PR title and description match the criteria, the
+# description is matched locally against the body_pattern regex
+def check_pr_title_and_description(repo, pr, body_pattern):
     pr_title = pr["title"]
     pr_url = pr["url"]
 
     # Check if the PR title contains the specific text
-    if (
-        "chore(deps): update konflux references" not in pr_title
-        and "Update Konflux references" not in pr_title
-    ):
+    if not any(keyword in pr_title for keyword in title_keywords):
         print(f"{repo} PR title does not match for {pr_url}")
         return False
 
-    # Fetch the PR description (body) and check for the specific migration update
-    result = subprocess.run(
-        ["gh", "pr", "view", pr_url, "--repo", repo, "--json", "body"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    if result.returncode != 0:
-        print(f"{repo} Error fetching PR description for {pr_url}: {result.stderr}")
-        return False
-
-    pr_description = result.stdout
-    if (
-        "tekton-catalog/task-buildah | `0.2` -> `0.3` | :warning:[migration]"
-        not in pr_description
-    ):
+    # Check the PR description (body) for the specific migration update
+    pr_description = pr["body"] or ""
+    if not re.search(body_pattern, pr_description):
         print(f"{repo} PR description does not match for {pr_url}")
         return False
 
@@ -74,47 +106,26 @@ def check_pr_title_and_description(repo, pr):
 
 
 # Function to check if a PR is trying to update the version of tekton-catalog/task-buildah
-def check_update_pr(repo, pr):
+def check_update_pr(repo, pr, body_pattern):
 
     # Check if the PR title and description match the specified patterns
-    return check_pr_title_and_description(repo, pr)
+    return check_pr_title_and_description(repo, pr, body_pattern)
 
 
-# Function to update YAML file
-def update_yaml_file(repo_dir):
+# Function to apply the migration rules to the *.yaml files of the .tekton folder,
+# all rules run on each file in one pass and only the changed files are written
+def update_yaml_file(repo_dir, rules):
     tekton_dir = os.path.join(repo_dir, ".tekton")
     if not os.path.exists(tekton_dir):
         print(f"No .tekton directory found. Skipping...")
         return ""
 
-    # Iterate through the files in the .tekton directory
-    for root, dirs, files in os.walk(tekton_dir):
-        for yaml_file in files:
-            file_path = os.path.join(root, yaml_file)
-            with open(file_path, "r") as file:
-                content = file.readlines()
-
-            # Regular expression to find the target line and the lines before and after
-            regex = re.compile(r".*JAVA_COMMUNITY_DEPENDENCIES.*")
-
-            new_content = []
-            skip_next = False
-            for i, line in enumerate(content):
-                if skip_next:
-                    skip_next = False
-                    continue
-                if regex.match(line):
-                    # Skip this line and the one before and after it
-                    if i > 0:
-                        new_content.pop()  # Remove the previous line
-                    skip_next = True  # Skip this line
-                else:
-                    new_content.append(line)
-
-            # Write the updated content back to the file
-            with open(file_path, "w") as file:
-                file.writelines(new_content)
-            print(f"File {file_path} has been updated.")
+    hits, changed = migrate_folder(tekton_dir, rules, get_yaml())
+    for file_path in changed:
+        print(f"File {file_path} has been updated.")
+    for rule in rules:
+        print(f"Rule {rule['name']}: {hits[rule['name']]} hits")
+    return hits
 
 
 def has_changes(repo_dir):
@@ -126,29 +137,21 @@ def has_changes(repo_dir):
     return result.returncode != 0
 
 
-# Function to commit and push changes
+# Function to commit the changes of the worktree of a PR and queue the push of the
+# commit to its branch. The pushes are queued under the workspace the worktree
+# belongs to, so the PRs of a repo are pushed together.
 def commit_and_push_changes(
     repo_dir,
     pr_ref,
-    commit_message="Migrate task buildah from 0.2 to 0.3",
-    dry_run=False,
+    queue,
+    workspace,
+    commit_message=migration_commit_message,
 ):
-    # Make sure we are on the correct branch for the PR
-    result = subprocess.run(
-        ["git", "-C", repo_dir, "checkout", pr_ref],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    if result.returncode != 0:
-        print(f"Error checking out branch {pr_ref}: {result.stderr}")
-        return
-
     if not has_changes(repo_dir):
         print(
             f"No changes for migration tekton files to commit in {repo_dir}. Skipping..."
         )
-        return ""
+        return "no changes"
 
     # Stage changes
     result = subprocess.run(
@@ -176,80 +179,93 @@ def commit_and_push_changes(
         print(f"Error committing changes: {result.stderr}")
         return
 
-    if not dry_run:
-        # Push changes to the remote branch
-        result = subprocess.run(
-            ["git", "-C", repo_dir, "push", "upstream", pr_ref],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        if result.returncode != 0:
-            print(f"Error pushing changes to PR: {result.stderr}")
-            return
+    # Queue the push of the commit, the worktree is removed before the queue is flushed
+    head = subprocess.run(
+        ["git", "-C", repo_dir, "rev-parse", "HEAD"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    queue.add(workspace, "upstream", head, pr_ref)
+    print(f"Changes committed for PR branch {pr_ref}")
+    return "migrated"
+
+
+# Function to clone a repo from the forked repository and fetch the heads of the
+# PRs into upstream/pull/<number>, with one fetch for all PRs
+def clone_repo_from_fork(repo, fork_user, repo_dir, pr_numbers, narrow=False):
+    clone_workspace(repo, fork_user, repo_dir, narrow, run=run)
+
+    # The PR heads are not branches of the mirror, they are fetched from upstream
+    refspecs = [
+        f"+refs/pull/{number}/head:refs/remotes/upstream/pull/{number}"
+        for number in pr_numbers
+    ]
+    fetch = ["git", "-C", repo_dir, "fetch", "--no-tags"]
+    if narrow:
+        fetch.append("--filter=blob:none")
+    run([*fetch, "upstream", *refspecs], check=True)
+
+
+# Function to get the path of the worktree of a PR, next to the workspace of the repo
+def pr_worktree_path(repo_dir, pr_number):
+    return os.path.abspath(f"{repo_dir}-worktrees/pr-{pr_number}")
+
+
+# Function to add a worktree of the workspace checked out at the fetched head of a
+# PR, a worktree left over by an interrupted run is replaced
+def add_pr_worktree(repo_dir, pr_number):
+    worktree = pr_worktree_path(repo_dir, pr_number)
+    remove_pr_worktree(repo_dir, worktree)
+    run(
+        [
+            "git",
+            "-C",
+            repo_dir,
+            "worktree",
+            "add",
+            "--detach",
+            worktree,
+            f"upstream/pull/{pr_number}",
+        ],
+        check=True,
+    )
+    return worktree
 
-    print(f"Changes successfully pushed to PR branch {pr_ref}")
 
+# Function to remove the worktree of a PR
+def remove_pr_worktree(repo_dir, worktree):
+    run(
+        ["git", "-C", repo_dir, "worktree", "remove", "--force", worktree],
+        capture_output=True,
+    )
+    run(["git", "-C", repo_dir, "worktree", "prune"], capture_output=True)
 
-# Function to check if the "upstream" remote exists, if not, add it
-def check_upstream_remote(repo_dir, upstream_url):
-    try:
-        # Check if the upstream remote already exists
-        result = subprocess.run(
-            ["git", "-C", repo_dir, "remote", "get-url", "upstream"],
-            capture_output=True,
-            text=True,
-        )
 
-        # If the upstream remote does not exist, the command will fail
-        if result.returncode != 0:
-            print(f"Upstream remote not found. Adding upstream remote: {upstream_url}")
-            subprocess.run(
-                ["git", "-C", repo_dir, "remote", "add", "upstream", upstream_url],
-                check=True,
-            )
-        else:
-            print("Upstream remote already exists.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking or adding upstream remote: {e}")
-
-
-# Function to clone a repo from the forked repository
-def clone_repo_from_fork(repo, fork_user, repo_dir, pr_ref):
-    # Construct the URL for the forked repository
-    forked_repo_url = f"git@github.com:{fork_user}/{repo.split('/')[1]}.git"
-    if not os.path.exists(repo_dir):
-        print(f"Cloning {forked_repo_url} into {repo_dir}...")
-        subprocess.run(["git", "clone", forked_repo_url, repo_dir], check=True)
-    # else:
-    #     print(f"Repository {repo_dir} already exists. Pulling latest changes...")
-    #     subprocess.run(['git', '-C', repo_dir, 'pull'], check=True)
-
-    # Add the original repository as the upstream remote
-    original_repo_url = f"git@github.com:{repo}.git"
-    check_upstream_remote(repo_dir, original_repo_url)
-
-    subprocess.run(["git", "-C", repo_dir, "fetch", "upstream"], check=True)
-
-    original_directory = os.getcwd()
+# Function to migrate one PR in its own worktree, returns the outcome, or None on errors.
+# Each PR has its own worktree, so the PRs of a repo can be migrated concurrently.
+def migrate_pr(repo_dir, pr, migration, queue):
+    worktree = pr_worktree_path(repo_dir, pr["number"])
     try:
-        # Change to the specified directory
-        os.chdir(repo_dir)
-
-        # Checkout the PR branch using gh pr checkout
-        result = subprocess.run(
-            ["gh", "pr", "--repo", repo, "checkout", pr_ref],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+        add_pr_worktree(repo_dir, pr["number"])
+
+        # Step 4: Update the YAML file
+        update_yaml_file(worktree, migration["compiled_rules"])
+
+        # Step 5: Commit and queue the push of the changes to the PR
+        return commit_and_push_changes(
+            worktree,
+            pr["headRefName"],
+            queue,
+            repo_dir,
+            commit_message=migration["commit_message"],
         )
-        if result.returncode != 0:
-            print(f"Error checking out PR branch {pr_ref}: {result.stderr}")
-        print(f"{repo} checkouted to {pr_ref}")
+    except Exception as e:
+        # One failing PR does not stop the others, their commits are still pushed
+        print(f"Error migrating PR {pr['url']}: {e}")
+        return None
     finally:
-        # Return to the original directory
-        os.chdir(original_directory)
-        print(f"Changing dir to {original_directory}")
+        remove_pr_worktree(repo_dir, worktree)
 
 
 # Main function
@@ -268,7 +284,65 @@ def clone_repo_from_fork(repo, fork_user, repo_dir, pr_ref):
     default=False,
     help="set to true will not create PR and push changes",
 )
-def main(repos, github_user, dry_run):
+@click.option(
+    "--narrow",
+    is_flag=True,
+    default=False,
+    help="set to true will clone only the .tekton folder and fetch only the PR branches",
+)
+@click.option(
+    "--no-run-cache",
+    is_flag=True,
+    default=False,
+    help="set to true will process the PRs even if they were handled at the same head commit",
+)
+@click.option(
+    "--atomic-push",
+    is_flag=True,
+    default=False,
+    help="set to true will push the PR branches of a repo atomically, all of them or none",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="the number of PRs of a repo to migrate concurrently",
+)
+@click.option(
+    "--rules",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="the YAML file of the migration rules, the built-in buildah 0.2 to 0.3 migration is used if not set",
+)
+@click.option(
+    "--body-pattern",
+    type=click.STRING,
+    default=None,
+    help="the regex the PR descriptions must match, the description of the migration is used if not set",
+)
+def main(
+    repos,
+    github_user,
+    dry_run,
+    narrow,
+    no_run_cache,
+    atomic_push,
+    jobs,
+    rules,
+    body_pattern,
+):
+    try:
+        migration = load_migration(rules)
+    except ValueError as e:
+        print(f"Error: invalid rules file {rules}: {e}")
+        return
+    if body_pattern is None:
+        body_pattern = re.escape(migration["description"])
+    try:
+        re.compile(body_pattern)
+    except re.error as e:
+        print(f"Error: invalid body pattern {body_pattern}: {e}")
+        return
     reposmap = {
         # supportted repos, repo: owners
         "stolostron/ocm": ["zhujian7", "xuezhaojun"],
@@ -296,36 +370,81 @@ def main(repos, github_user, dry_run):
     if not os.path.exists(tmp_dir):
         os.makedirs(tmp_dir)
 
+    # A dry run does not push anything, its outcomes are not recorded
+    run_cache = None if no_run_cache or dry_run else RunCache("migrate")
+    config = {
+        "title_keywords": title_keywords,
+        "body_pattern": body_pattern,
+        "rules": migration["rules"],
+        "commit_message": migration["commit_message"],
+    }
+
+    # Step 1: Get the PRs of all repos at once
+    prs_by_repo = get_prs(list(reposmap))
+    # The commits of all PRs are pushed at the end of the run
+    queue = PushQueue(atomic=atomic_push)
+    handled = []
+
     # for repo in repos:
     for repo, owners in reposmap.items():
         repo_dir = os.path.join(
             tmp_dir, repo.split("/")[1]
         )  # Use repo name as directory name
 
-        # Step 1: Get PRs
-        prs = get_prs(repo)
+        prs = prs_by_repo[repo]
         if not prs:
-            return
+            continue
 
         # Step 2: Check each PR for the task-buildah version change
-        for pr in prs:
-            pr_data = yaml.load(pr)
-            if check_update_pr(repo, pr_data):
-                pr_ref = pr_data["headRefName"]
-                print(f"Debug: {pr_data}")
-                # Step 3: Clone the repository from the forked version
-                clone_repo_from_fork(repo, github_user, repo_dir, pr_ref)
-
-                # Step 4: Update the YAML file if a matching PR is found
-                update_yaml_file(repo_dir)
-
-                # Step 5: Commit and push changes to the PR
-                commit_and_push_changes(
-                    repo_dir,
-                    pr_ref,
-                    commit_message="Migrate task buildah from 0.2 to 0.3",
-                    dry_run=dry_run,
+        matching = []
+        for pr_data in prs:
+            # PRs already handled at the same head commit with the same config are skipped
+            head_sha = pr_data["headRefOid"]
+            pr_key = f"{repo}#{pr_data['number']}"
+            if run_cache and run_cache.get(pr_key, head_sha, config):
+                print(
+                    f"{repo} PR {pr_data['url']} was already handled at {head_sha[:7]}. Skipping..."
                 )
+                continue
+            if not check_update_pr(repo, pr_data, body_pattern):
+                if run_cache:
+                    run_cache.put(pr_key, head_sha, config, "not matching")
+                continue
+            # The PR data also has the body, which is too long to print
+            print(
+                f"Debug: PR #{pr_data['number']} {pr_data['title']} ({pr_data['headRefName']})"
+            )
+            matching.append(pr_data)
+        if not matching:
+            continue
+
+        # Step 3: Clone the repository from the forked version and fetch the heads of all matching PRs
+        clone_repo_from_fork(
+            repo, github_user, repo_dir, [pr["number"] for pr in matching], narrow
+        )
+
+        # Step 4 and 5: Update the YAML files and commit, each PR in its own worktree
+        outcomes = run_grouped(
+            lambda pr: migrate_pr(repo_dir, pr, migration, queue), matching, jobs
+        )
+        for pr_data, outcome in zip(matching, outcomes):
+            if outcome:
+                handled.append((repo, repo_dir, pr_data, outcome))
+
+    # Step 6: Push the commits of all PRs, one push per repo
+    pushed = queue.flush(dry_run)
+    for repo, repo_dir, pr_data, outcome in handled:
+        pr_ref = pr_data["headRefName"]
+        if outcome == "migrated":
+            if not pushed[(repo_dir, "upstream", pr_ref)]:
+                print(f"Error pushing changes to PR {pr_data['url']}")
+                continue
+            print(f"Changes successfully pushed to PR branch {pr_ref}")
+        if run_cache:
+            pr_key = f"{repo}#{pr_data['number']}"
+            run_cache.put(pr_key, pr_data["headRefOid"], config, outcome)
+
+    print(get_client().scheduler.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import io
+import os
+import re
+from collections import Counter
+
+# A migration is a list of rules applied to the *.yaml files of the .tekton
+# folder. There are two kinds of rules:
+#
+# - line rules, with "pattern": a regex matched against each line. The matching
+#   lines are removed together with "before" lines before and "after" lines
+#   after them, or, with "replace", the matches are substituted instead.
+#       - name: remove JAVA_COMMUNITY_DEPENDENCIES
+#         pattern: ".*JAVA_COMMUNITY_DEPENDENCIES.*"
+#         before: 1
+#         after: 1
+#
+# - YAML path rules, with "path": dot separated keys or list indexes, "*" matches
+#   every key or item. The matching values are deleted ("delete: true"), set to a
+#   new value ("set"), or have a regex substituted in them ("pattern" and "replace").
+#       - name: bump task-buildah
+#         path: spec.pipelineSpec.tasks.*.taskRef.params.*.value
+#         pattern: "task-buildah:0.2@sha256:[0-9a-f]+"
+#         replace: "task-buildah:0.3@sha256:..."
+#
+# Every rule has a "name", which is used to report how many times it hit.
+
+
+# Function to check the rules of a migration and compile their regexes, raises
+# ValueError if a rule is invalid
+def compile_rules(rules):
+    compiled = []
+    for index, rule in enumerate(rules):
+        rule = dict(rule)
+        rule.setdefault("name", f"rule {index}")
+        name = rule["name"]
+        if "path" in rule:
+            actions = [key for key in ("delete", "set", "replace") if key in rule]
+            if len(actions) != 1:
+                raise ValueError(
+                    f"{name}: a path rule needs exactly one of delete, set or replace"
+                )
+            if "replace" in rule and "pattern" not in rule:
+                raise ValueError(f"{name}: replace needs a pattern")
+            rule["path"] = str(rule["path"]).split(".")
+        elif "pattern" not in rule:
+            raise ValueError(f"{name}: a rule needs a pattern or a path")
+        if "pattern" in rule:
+            try:
+                rule["pattern"] = re.compile(rule["pattern"])
+            except re.error as e:
+                raise ValueError(f"{name}: invalid pattern: {e}")
+        rule.setdefault("before", 0)
+        rule.setdefault("after", 0)
+        compiled.append(rule)
+    return compiled
+
+
+# Function to apply the line rules to the lines of a file, returns the new lines.
+# The lines are scanned in order, and a line already in the removal window of an
+# earlier match is not matched again, so each removal counts as one hit.
+def apply_line_rules(lines, rules, hits):
+    removing = [rule for rule in rules if "replace" not in rule]
+    replacing = [rule for rule in rules if "replace" in rule]
+    removed = set()
+    for i, line in enumerate(lines):
+        if i in removed:
+            continue
+        for rule in removing:
+            if rule["pattern"].match(line):
+                hits[rule["name"]] += 1
+                removed.update(range(i - rule["before"], i + rule["after"] + 1))
+                break
+    new_lines = []
+    for i, line in enumerate(lines):
+        if i in removed:
+            continue
+        for rule in replacing:
+            line, count = rule["pattern"].subn(rule["replace"], line)
+            hits[rule["name"]] += count
+        new_lines.append(line)
+    return new_lines
+
+
+# Function to find the values at a path, yields (container, key) pairs
+def find_path(node, path):
+    if not path:
+        return
+    segment, rest = path[0], path[1:]
+    if isinstance(node, dict):
+        keys = list(node) if segment == "*" else [segment] if segment in node else []
+    elif isinstance(node, list):
+        if segment == "*":
+            keys = list(range(len(node)))
+        elif segment.isdigit() and int(segment) < len(node):
+            keys = [int(segment)]
+        else:
+            keys = []
+    else:
+        return
+    for key in keys:
+        if rest:
+            yield from find_path(node[key], rest)
+        else:
+            yield node, key
+
+
+# Function to apply the YAML path rules to a loaded document
+def apply_path_rules(data, rules, hits):
+    for rule in rules:
+        matches = list(find_path(data, rule["path"]))
+        if rule.get("delete"):
+            # Delete the list items from the last one, so the indexes stay valid
+            for container, key in reversed(matches):
+                del container[key]
+                hits[rule["name"]] += 1
+            continue
+        for container, key in matches:
+            value = container[key]
+            if "set" in rule:
+                new_value = rule["set"]
+            elif isinstance(value, str):
+                new_value = rule["pattern"].sub(rule["replace"], value)
+            else:
+                continue
+            if new_value == value:
+                continue
+            if isinstance(value, str) and isinstance(new_value, str):
+                # Keep the quoting style of the old value, e.g. a DoubleQuotedScalarString
+                new_value = type(value)(new_value)
+            container[key] = new_value
+            hits[rule["name"]] += 1
+
+
+# Function to apply all rules to the content of a file in one pass: the line rules
+# on the text, then the path rules on the document loaded once with yaml.
+# Returns the new content and the hits of each rule.
+def migrate_content(content, rules, yaml):
+    hits = Counter()
+    line_rules = [rule for rule in rules if "path" not in rule]
+    path_rules = [rule for rule in rules if "path" in rule]
+    if line_rules:
+        lines = apply_line_rules(content.splitlines(keepends=True), line_rules, hits)
+        content = "".join(lines)
+    if path_rules:
+        data = yaml.load(content)
+        path_hits = Counter()
+        apply_path_rules(data, path_rules, path_hits)
+        # The document is only dumped if a path rule changed it
+        if path_hits:
+            stream = io.StringIO()
+            yaml.dump(data, stream)
+            content = stream.getvalue()
+            hits.update(path_hits)
+    return content, hits
+
+
+# Function to migrate the *.yaml files of a folder, only the changed files are
+# written. Returns the hits of each rule and the paths of the changed files.
+def migrate_folder(folder, rules, yaml):
+    hits = Counter()
+    changed = []
+    for root, dirs, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.endswith(".yaml"):
+                continue
+            file_path = os.path.join(root, name)
+            with open(file_path, "r") as file:
+                content = file.read()
+            new_content, file_hits = migrate_content(content, rules, yaml)
+            hits.update(file_hits)
+            if new_content != content:
+                with open(file_path, "w") as file:
+                    file.write(new_content)
+                changed.append(file_path)
+    return hits, changed
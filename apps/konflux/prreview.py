@@ -1,215 +1,692 @@
-import subprocess
 import json
+import threading
+import time
 import click
 
+from apps.common.cachedir import cache_dir
+from apps.konflux.ghclient import GitHubError, disable_cache, get_client
+from apps.konflux.httpcache import HTTPCache, cache_key
+from apps.konflux.ledger import ActionLedger
+from apps.konflux.prsearch import (
+    build_pr_search_queries,
+    common_title_terms,
+    search_pull_requests,
+)
+from apps.konflux.webhook import WebhookServer
+from apps.konflux.workers import run_grouped
+
+# The action reported for PRs whose checks are still running in --wait-ci mode
+WAITING_FOR_CI = "waiting for CI"
+# The longest interval between two polls of the pending checks
+MAX_WAIT_INTERVAL = 300
+# How many aliased mutations are sent in one GraphQL request
+MUTATION_BATCH_SIZE = 10
+
+# The pull_request event actions that can change what prreview decides
+PR_ACTIONS = [
+    "opened",
+    "reopened",
+    "edited",
+    "synchronize",
+    "labeled",
+    "unlabeled",
+    "ready_for_review",
+]
+
+# GraphQL fields of a PR with everything prreview needs to decide on it:
+# changed files, labels and the status check rollup of the head commit
+PR_FIELDS = """
+  id
+  number
+  title
+  state
+  baseRefName
+  headRefOid
+  files(first: 20) {
+    pageInfo { hasNextPage endCursor }
+    nodes { path }
+  }
+  labels(first: 100) { nodes { name } }
+  commits(last: 1) {
+    nodes {
+      commit {
+        statusCheckRollup {
+          state
+          contexts(first: 100) {
+            nodes {
+              __typename
+              ... on CheckRun { name conclusion status }
+              ... on StatusContext { context state }
+            }
+          }
+        }
+      }
+    }
+  }
+"""
+
+# GraphQL query to fetch a single PR
+PR_QUERY = (
+    """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {"""
+    + PR_FIELDS
+    + """}
+  }
+}
+"""
+)
+
+
+# GraphQL query to fetch the next page of the changed files of a PR
+FILES_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      files(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path }
+      }
+    }
+  }
+}
+"""
+
+
+# Function to flatten a PR node of the snapshot query into a plain dict
+def snapshot_pr(node):
+    rollup = []
+    rollup_state = None
+    commits = node["commits"]["nodes"]
+    if commits and commits[0]["commit"]["statusCheckRollup"]:
+        rollup_state = commits[0]["commit"]["statusCheckRollup"]["state"]
+        contexts = commits[0]["commit"]["statusCheckRollup"]["contexts"]["nodes"]
+        for context in contexts:
+            context = dict(context)
+            context.pop("__typename", None)
+            rollup.append(context)
+    return {
+        "id": node["id"],
+        "number": node["number"],
+        "title": node["title"],
+        "state": node["state"],
+        "baseRefName": node["baseRefName"],
+        "headRefOid": node["headRefOid"],
+        # Only the first page of the changed files, see iter_changed_files
+        "files": [file["path"] for file in node["files"]["nodes"]],
+        "filesCursor": (
+            node["files"]["pageInfo"]["endCursor"]
+            if node["files"]["pageInfo"]["hasNextPage"]
+            else None
+        ),
+        "labels": [label["name"] for label in node["labels"]["nodes"]],
+        "statusCheckRollup": rollup,
+        "statusCheckRollupState": rollup_state,
+    }
+
+
+_snapshot_cache = None
+_snapshot_lock = threading.Lock()
+
+
+# Function to get the cache of the PR snapshots of the repos, kept apart from the
+# HTTP responses and shared by all threads, None if the HTTP cache is turned off
+def get_snapshot_cache():
+    global _snapshot_cache
+    with _snapshot_lock:
+        if _snapshot_cache is None and get_client().cache is not None:
+            _snapshot_cache = HTTPCache(cache_dir("snapshots"))
+        return _snapshot_cache
+
+
+# Function to build the searches of the open PRs of a repo, filtered on the
+# server by author, title terms and base branch
+def repo_search_queries(repo, settings):
+    return build_pr_search_queries(
+        [repo],
+        authors=settings["authors"],
+        title_terms=common_title_terms(settings["keywords"]),
+        bases=settings["bases"],
+    )
 
-# Function to list open PRs containing "Konflux" in the title
-def list_prs(repo):
+
+# Function to get the snapshot of the open Konflux PRs of a repo. GraphQL responses can
+# not be revalidated, so a conditional request on the REST PR listing is used to
+# tell if any open PR changed (title, base, labels, new commits, opened/closed)
+# since the last run. If not, the snapshot of the last run is reused. Check
+# results do not show up in the listing, so it is never reused for --check-status.
+def fetch_repo_snapshot(repo, settings):
+    client = get_client()
     try:
-        # Using gh command to list open PRs in JSON format
-        result = subprocess.run(
-            [
-                "gh",
-                "pr",
-                "list",
-                "--repo",
-                repo,
-                "--state",
-                "open",
-                "--json",
-                "number,title,baseRefName",
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
+        queries = repo_search_queries(repo, settings)
+        snapshots = get_snapshot_cache()
+        if snapshots is None:
+            return [
+                snapshot_pr(node) for node in search_pull_requests(queries, PR_FIELDS)
+            ]
+
+        listing, not_modified = client.conditional_get(
+            f"repos/{repo}/pulls", {"state": "open", "per_page": 100}
+        )
+        snapshot_key = cache_key(
+            repo,
+            {
+                "fields": PR_FIELDS,
+                "queries": queries,
+                "listing": json.dumps(listing, sort_keys=True),
+            },
         )
-        prs = json.loads(result.stdout)
+        # The listing only covers the first 100 open PRs
+        reusable = not_modified and not settings["check_status"] and len(listing) < 100
+        entry = snapshots.get(snapshot_key) if reusable else None
+        if entry:
+            print(f"Open PRs in {repo} have not changed, reusing the last snapshot.")
+            return entry["body"]
+
+        prs = [snapshot_pr(node) for node in search_pull_requests(queries, PR_FIELDS)]
+        snapshots.put(snapshot_key, {"body": prs})
         return prs
-    except subprocess.CalledProcessError as e:
+    except GitHubError as e:
         print(f"Error fetching PRs for {repo}: {e}")
         return []
 
 
-# Function to change the base branch of a PR
-def change_base_branch(repo, pr_number, new_base_branch):
+# Function to fetch a single PR, returns None if it can not be fetched
+def fetch_pr(repo, pr_number):
+    owner, name = repo.split("/")
     try:
-        # Using gh command to change the base branch of a PR
-        subprocess.run(
-            [
-                "gh",
-                "pr",
-                "edit",
-                str(pr_number),
-                "--repo",
-                repo,
-                "--base",
-                new_base_branch,
-            ],
-            check=True,
-        )
-        print(
-            f"Successfully updated PR #{pr_number} in {repo} to base branch {new_base_branch}."
+        data = get_client().graphql(
+            PR_QUERY, {"owner": owner, "name": name, "number": pr_number}
         )
-    except subprocess.CalledProcessError as e:
-        print(f"Error updating PR #{pr_number} in {repo}: {e}")
+    except GitHubError as e:
+        print(f"Error fetching PR #{pr_number} in {repo}: {e}")
+        return None
+    return snapshot_pr(data["repository"]["pullRequest"])
 
 
 # Function to check if a PR has the 'lgtm' and 'approved' labels
-def has_lgtm_and_approved_labels(repo, pr_number):
-    try:
-        # Using gh command to get the PR details, specifically the labels
-        result = subprocess.run(
-            ["gh", "pr", "view", str(pr_number), "--repo", repo, "--json", "labels"],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        pr_data = json.loads(result.stdout)
-        labels = [label["name"] for label in pr_data["labels"]]
-        return "lgtm" in labels, "approved" in labels
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking labels for PR #{pr_number} in {repo}: {e}")
-        return False, False
+def has_lgtm_and_approved_labels(pr):
+    labels = pr["labels"]
+    return "lgtm" in labels, "approved" in labels
 
 
-# Function to comment "/lgtm" on a PR
-def comment_lgtm_approve(repo, pr_number):
-    try:
-        # Using gh command to comment "/lgtm" on the PR
-        subprocess.run(
-            [
-                "gh",
-                "pr",
-                "comment",
-                str(pr_number),
-                "--repo",
-                repo,
-                "--body",
-                "/lgtm\n/approve",
-            ],
-            check=True,
+# Function to get the PR title starting with "🌱", returns None if it already starts with "🌱" or ":seedling:"
+def seedling_title(title):
+    if title.startswith("🌱") or title.startswith(":seedling:"):
+        return None
+    return "🌱 " + title
+
+
+# Function to get the names of the failed status checks of a PR
+def get_failed_checks(pr):
+    failed_checks = []
+    for index, check in enumerate(pr["statusCheckRollup"]):
+        status = check.get("conclusion", check.get("state"))
+        if not status:
+            continue
+        if status.lower() == "failure":
+            name = check.get("name", check.get("context", str(index)))
+            failed_checks.append(name)
+    return failed_checks
+
+
+# Function to build the comment notifying the owners of the failed status checks, with format:
+# "Hello @owner1 @owner2, the following checks have failed for this PR: check1, check2"
+def failed_checks_comment(owners, failed_checks):
+    owners_mention = " ".join([f"@{owner}" for owner in owners])
+    failed_checks_str = ", ".join(failed_checks)
+    return f"Hello {owners_mention}, the following checks have failed for this PR: {failed_checks_str}"
+
+
+# Function to get the check status of a PR as recorded in the ledger
+def checks_digest(pr):
+    return f"{pr['statusCheckRollupState']}:{','.join(sorted(get_failed_checks(pr)))}"
+
+
+# Function to iterate over the changed files of a PR. The first page comes with
+# the snapshot, the next pages are only fetched when the caller keeps iterating,
+# so a check can stop at the first file it does not like.
+def iter_changed_files(repo, pr):
+    yield from pr["files"]
+    owner, name = repo.split("/")
+    cursor = pr["filesCursor"]
+    while cursor:
+        data = get_client().graphql(
+            FILES_QUERY,
+            {"owner": owner, "name": name, "number": pr["number"], "cursor": cursor},
+        )
+        files = data["repository"]["pullRequest"]["files"]
+        for file in files["nodes"]:
+            yield file["path"]
+        cursor = (
+            files["pageInfo"]["endCursor"] if files["pageInfo"]["hasNextPage"] else None
         )
-        print(f"Successfully commented '/lgtm' on PR #{pr_number} in {repo}.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error commenting '/lgtm' on PR #{pr_number} in {repo}: {e}")
 
 
-# Function to change PR title to start with "🌱" if it doesn't start with ":seeding:"
-def update_pr_title(repo, pr_number, title):
-    if not title.startswith("🌱") and not title.startswith(":seedling:"):
-        new_title = "🌱 " + title
+# Function to check if all changed files are in the ".tekton" directory
+def all_files_in_tekton(files):
+    for file in files:
+        if not file.startswith(".tekton/"):
+            return False
+    return True
+
+
+# Function to add a mutation to the plan of a PR. A mutation either updates the
+# PR (base branch, title) or comments on it, see apply_plans.
+def add_mutation(plan, action, report, message, error, update=None, comment=None):
+    plan["mutations"].append(
+        {
+            "action": action,
+            "report": report,
+            "message": message,
+            "error": error,
+            "update": update,
+            "comment": comment,
+        }
+    )
+
+
+# Function to review one PR from the snapshot without changing it. Returns the
+# plan of the PR: the mutations to apply, the ledger actions already handled and
+# whether its checks are still running, or None if the PR is not to be touched.
+def plan_pr(repo, owners, pr, settings):
+    title_match = False
+    content_match = False
+    if any(keyword in pr["title"] for keyword in settings["keywords"]):
+        title_match = True
+    # Check if all files changed are in the ".tekton" directory, and comment "/lgtm" if true.
+    # Only done for matching titles, it may need to page through the files of big PRs.
+    if title_match:
         try:
-            subprocess.run(
-                [
-                    "gh",
-                    "pr",
-                    "edit",
-                    str(pr_number),
-                    "--repo",
-                    repo,
-                    "--title",
-                    new_title,
-                ],
-                check=True,
-            )
+            content_match = all_files_in_tekton(iter_changed_files(repo, pr))
+        except GitHubError as e:
+            print(f"Error fetching changed files for PR #{pr['number']} in {repo}: {e}")
+    print(
+        f"PR #{pr['number']} in {repo}, content_match: {content_match}, title_match: {title_match}, title: {pr['title']}"
+    )
+    if not (title_match and content_match):
+        return None
+
+    # Actions already handled by an earlier run for the same head commit and checks are skipped
+    ledger = settings["ledger"]
+    requested = {"retarget"}
+    if settings["seedling"]:
+        requested.add("title")
+    if settings["check_status"]:
+        requested.add("cc")
+    if settings["approve"]:
+        requested.add("lgtm")
+    plan = {
+        "repo": repo,
+        "pr": pr,
+        "checks": checks_digest(pr),
+        "handled": set(),
+        "mutations": [],
+        "waiting": False,
+        "applied": [],
+    }
+    handled = plan["handled"]
+    if ledger:
+        handled |= ledger.handled_actions(
+            repo, pr["number"], pr["headRefOid"], plan["checks"]
+        )
+        if requested <= handled:
             print(
-                f"Successfully updated title of PR #{pr_number} in {repo} to '{new_title}'."
+                f"PR #{pr['number']} in {repo} was already handled at {pr['headRefOid'][:7]}. Skipping."
             )
-        except subprocess.CalledProcessError as e:
-            print(f"Error updating title of PR #{pr_number} in {repo}: {e}")
+            return None
 
-
-# Function to check if the PR has any failed status checks, and comment on the PR to notify the owners
-def check_failed_status(repo, pr_number, owners):
-    try:
-        # Get the list of checks for this PR using the GitHub CLI
-        result = subprocess.run(
-            [
-                "gh",
-                "pr",
-                "view",
-                str(pr_number),
-                "--repo",
-                repo,
-                "--json",
-                "statusCheckRollup",
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
+    branch_after_changing = settings["branch_after_changing"]
+    if "retarget" in handled:
+        pass
+    elif pr["baseRefName"] not in settings["branches_before_changing"]:
+        handled.add("retarget")
+    elif pr["baseRefName"] == branch_after_changing:
+        print(
+            f"PR #{pr['number']} in {repo} already targets {branch_after_changing}. Skipping."
+        )
+        handled.add("retarget")
+    else:
+        print(
+            f"PR #{pr['number']} in {repo} targets {pr['baseRefName']}. Changing to {branch_after_changing}."
+        )
+        add_mutation(
+            plan,
+            "retarget",
+            f"retarget to {branch_after_changing}",
+            f"Successfully updated PR #{pr['number']} in {repo} to base branch {branch_after_changing}.",
+            f"Error updating PR #{pr['number']} in {repo}",
+            update={"baseRefName": branch_after_changing},
         )
 
-        if result.returncode != 0:
-            print(f"Error retrieving PR status for {repo} {pr_number}: {result.stderr}")
-            return False
-
-        # Parse the JSON response
-        pr_data = json.loads(result.stdout)
+    if settings["seedling"] and "title" not in handled:
+        # Check if the PR title starts with ":seeding:" and update it if not
+        new_title = seedling_title(pr["title"])
+        if new_title:
+            add_mutation(
+                plan,
+                "title",
+                "seedling",
+                f"Successfully updated title of PR #{pr['number']} in {repo} to '{new_title}'.",
+                f"Error updating title of PR #{pr['number']} in {repo}",
+                update={"title": new_title},
+            )
+        else:
+            handled.add("title")
 
-        # Check if the status checks have failed
-        failed_checks = []
+    if settings["wait_ci"] and ci_pending(pr):
+        # Decided once the checks finish, see wait_for_ci
+        print(f"Checks of PR #{pr['number']} in {repo} are still running.")
+        plan["waiting"] = True
+        return plan
 
-        for index, check in enumerate(pr_data.get("statusCheckRollup", {})):
-            status = check.get("conclusion", check.get("state"))
-            if not status:
-                continue
-            if status.lower() == "failure":
-                name = check.get("name", check.get("context", str(index)))
-                failed_checks.append(name)
+    ci_failed = False
+    if settings["check_status"]:
+        # Check if the PR has any failed status checks, and notify the owners once
+        failed_checks = get_failed_checks(pr)
         print(
-            f"PR #{pr_number} in {repo} has the following failed checks: {failed_checks}"
+            f"PR #{pr['number']} in {repo} has the following failed checks: {failed_checks}"
         )
+        ci_failed = bool(failed_checks)
+        if "cc" in handled:
+            if ci_failed:
+                print(
+                    f"Owners of PR #{pr['number']} in {repo} were already notified. Skipping."
+                )
+        elif not ci_failed:
+            handled.add("cc")
+        else:
+            add_mutation(
+                plan,
+                "cc",
+                "cc on failed checks",
+                f"Commented on PR #{pr['number']} in {repo} with failed checks.",
+                f"Error commenting failed checks for PR #{pr['number']} in {repo}",
+                comment=failed_checks_comment(owners, failed_checks),
+            )
 
-        if failed_checks:
-            # Comment on the PR with the failed checks with format:
-            # "Hello @owner1 @owner2, the following checks have failed for this PR: check1, check2"
-            owners_mention = " ".join([f"@{owner}" for owner in owners])
-            failed_checks_str = ", ".join(failed_checks)
-            comment = f"Hello {owners_mention}, the following checks have failed for this PR: {failed_checks_str}"
-            subprocess.run(
-                [
-                    "gh",
-                    "pr",
-                    "comment",
-                    str(pr_number),
-                    "--repo",
-                    repo,
-                    "--body",
-                    comment,
-                ],
-                check=True,
+    if settings["approve"] and not ci_failed and "lgtm" not in handled:
+        lgtm, approved = has_lgtm_and_approved_labels(pr)
+        if lgtm and approved:
+            print(
+                f"PR #{pr['number']} in {repo} already has 'lgtm' and 'approved' labels. Skipping."
+            )
+            handled.add("lgtm")
+        else:
+            print(f"Approving PR #{pr['number']} in {repo}.")
+            add_mutation(
+                plan,
+                "lgtm",
+                "lgtm/approve",
+                f"Successfully commented '/lgtm' on PR #{pr['number']} in {repo}.",
+                f"Error commenting '/lgtm' on PR #{pr['number']} in {repo}",
+                comment="/lgtm\n/approve",
             )
-            print(f"Commented on PR #{pr_number} in {repo} with failed checks.")
-            return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking status for PR #{pr_number} in {repo}: {e}")
-        return False
+    elif settings["approve"] and ci_failed:
+        # Never approved while the checks fail, the checks change when they are rerun
+        handled.add("lgtm")
 
+    return plan
 
-# Function to get a list of changed files in a PR
-def get_changed_files(repo, pr_number):
-    try:
-        # Using gh command to get the list of changed files in the PR
-        result = subprocess.run(
-            ["gh", "pr", "view", str(pr_number), "--repo", repo, "--json", "files"],
-            capture_output=True,
-            text=True,
-            check=True,
+
+# Function to review all PRs of one repo, returns the PRs with their plans
+def plan_repo(repo, owners, settings):
+    # Fetch all open PRs with their files, labels and checks at once
+    prs = fetch_repo_snapshot(repo, settings)
+    # The search index lags behind, so it can still return PRs that were just
+    # closed or merged, they are skipped like in handle_event
+    for pr in prs:
+        if pr["state"] != "OPEN":
+            print(f"PR #{pr['number']} in {repo} is {pr['state'].lower()}, skipping.")
+    prs = [pr for pr in prs if pr["state"] == "OPEN"]
+    # The repos are already planned concurrently, and planning a PR is mostly
+    # local work, so the PRs of a repo are planned one by one
+    return [(pr, plan_pr(repo, owners, pr, settings)) for pr in prs]
+
+
+# Function to get the GraphQL operations of a plan. The base branch and title
+# changes of a PR are merged into one updatePullRequest, each comment is one
+# addComment. Returns (mutations, operation name, input type, input) tuples.
+def plan_operations(plan):
+    operations = []
+    pr_id = plan["pr"]["id"]
+    updates = [mutation for mutation in plan["mutations"] if mutation["update"]]
+    if updates:
+        fields = {}
+        for mutation in updates:
+            fields.update(mutation["update"])
+        operations.append(
+            (
+                updates,
+                "updatePullRequest",
+                "UpdatePullRequestInput",
+                dict(fields, pullRequestId=pr_id),
+            )
         )
-        pr_data = json.loads(result.stdout)
-        files = [file["path"] for file in pr_data["files"]]
-        return files
-    except subprocess.CalledProcessError as e:
-        print(f"Error fetching changed files for PR #{pr_number} in {repo}: {e}")
+    for mutation in plan["mutations"]:
+        if mutation["comment"] is not None:
+            operations.append(
+                (
+                    [mutation],
+                    "addComment",
+                    "AddCommentInput",
+                    {"subjectId": pr_id, "body": mutation["comment"]},
+                )
+            )
+    return operations
+
+
+# Function to build one GraphQL request running the operations in order, aliased m0, m1, ...
+def build_mutation(operations):
+    variables = ", ".join(
+        f"$i{index}: {input_type}!"
+        for index, (_, _, input_type, _) in enumerate(operations)
+    )
+    fields = "".join(
+        f"  m{index}: {name}(input: $i{index}) {{ clientMutationId }}\n"
+        for index, (_, name, _, _) in enumerate(operations)
+    )
+    return f"mutation({variables}) {{\n{fields}}}"
+
+
+# Function to apply the mutations planned for the PRs, MUTATION_BATCH_SIZE
+# aliased mutations per GraphQL request. GraphQL runs the mutations of a request
+# one after the other, so the comments of a PR still follow its retarget. A
+# failed mutation only fails itself. The applied actions are recorded in the
+# ledger, together with the ones found unnecessary while planning.
+def apply_plans(plans, settings):
+    operations = [
+        (plan, operation) for plan in plans for operation in plan_operations(plan)
+    ]
+    for start in range(0, len(operations), MUTATION_BATCH_SIZE):
+        batch = operations[start : start + MUTATION_BATCH_SIZE]
+        ops = [operation for _, operation in batch]
+        variables = {f"i{index}": op[3] for index, op in enumerate(ops)}
+        failed = {}
+        try:
+            get_client().graphql(build_mutation(ops), variables, cost=len(ops))
+        except GitHubError as e:
+            # Errors of a single mutation point to its alias, the others fail the whole request
+            errors = e.errors or [{}]
+            for error in errors:
+                path = error.get("path") or []
+                if path and path[0].startswith("m"):
+                    failed[int(path[0][1:])] = error.get("message", str(error))
+                else:
+                    failed = {index: str(e) for index in range(len(ops))}
+                    break
+        for index, (plan, (mutations, _, _, _)) in enumerate(batch):
+            for mutation in mutations:
+                if index in failed:
+                    print(f"{mutation['error']}: {failed[index]}")
+                    continue
+                print(mutation["message"])
+                plan["applied"].append(mutation["report"])
+                plan["handled"].add(mutation["action"])
+
+    ledger = settings["ledger"]
+    if ledger:
+        for plan in plans:
+            pr = plan["pr"]
+            ledger.record(
+                plan["repo"],
+                pr["number"],
+                pr["headRefOid"],
+                plan["checks"],
+                plan["handled"],
+            )
+
+
+# Function to get the actions of a plan for the summary, the applied ones or,
+# with planned set, the ones that would be applied
+def plan_actions(plan, planned=False):
+    if plan is None:
         return []
+    if planned:
+        actions = [mutation["report"] for mutation in plan["mutations"]]
+    else:
+        actions = list(plan["applied"])
+    if plan["waiting"]:
+        actions.append(WAITING_FOR_CI)
+    return actions
 
 
-# Function to check if all changed files are in the ".tekton" directory
-def all_files_in_tekton(files):
-    for file in files:
-        if not file.startswith(".tekton/"):
-            return False
-    return True
+# Function to review one PR and apply its plan right away, returns the actions taken on it
+def process_pr(repo, owners, pr, settings):
+    plan = plan_pr(repo, owners, pr, settings)
+    if plan is None or settings["plan_only"]:
+        return plan_actions(plan, planned=True)
+    apply_plans([plan], settings)
+    return plan_actions(plan)
+
+
+# Function to tell if the checks of a PR are still running
+def ci_pending(pr):
+    return pr["statusCheckRollupState"] in ("PENDING", "EXPECTED")
+
+
+# Function to build one GraphQL query fetching all the given PRs, grouped by repo with aliases
+def build_poll_query(prs_by_repo):
+    repositories = []
+    for index, (repo, numbers) in enumerate(prs_by_repo.items()):
+        owner, name = repo.split("/")
+        pulls = "".join(
+            f"p{number}: pullRequest(number: {number}) {{{PR_FIELDS}}}\n"
+            for number in numbers
+        )
+        repositories.append(
+            f'r{index}: repository(owner: "{owner}", name: "{name}") {{\n{pulls}}}'
+        )
+    return "query {\n" + "\n".join(repositories) + "\n}"
+
+
+# Function to wait for the checks of the pending PRs of all repos to finish.
+# All pending PRs are polled together with one batched query per interval, the
+# interval grows while nothing changes and goes back to the start once a PR
+# settles. Every settled PR is reviewed again, the mutations of the PRs settled
+# in the same poll are applied together.
+# Returns the actions taken on the settled PRs, keyed by (repo, number).
+def wait_for_ci(pending, owners_map, settings):
+    interval = settings["wait_interval"]
+    started = time.monotonic()
+    deadline = started + settings["wait_timeout"]
+    waited = {}
+    results = {}
+    polls = 0
+    while pending:
+        if time.monotonic() + interval > deadline:
+            break
+        print(f"Waiting {interval:.0f}s for the checks of {len(pending)} PRs.")
+        time.sleep(interval)
+
+        prs_by_repo = {}
+        for repo, number in pending:
+            prs_by_repo.setdefault(repo, []).append(number)
+        polls += 1
+        try:
+            data = get_client().graphql(build_poll_query(prs_by_repo))
+        except GitHubError as e:
+            if not e.data:
+                print(f"Error polling the checks of the pending PRs: {e}")
+                interval = min(interval * 1.5, MAX_WAIT_INTERVAL)
+                continue
+            # The PRs that can not be read are null, the others are still usable
+            print(f"Error polling the checks of some pending PRs: {e}")
+            data = e.data
+
+        settled = {}
+        for index, (repo, numbers) in enumerate(prs_by_repo.items()):
+            for number in numbers:
+                node = (data.get(f"r{index}") or {}).get(f"p{number}")
+                if node is None:
+                    # The PR or its repo is no longer accessible, it is dropped like a closed PR
+                    pending.remove((repo, number))
+                    results[(repo, number)] = ["not accessible while waiting"]
+                    continue
+                pr = snapshot_pr(node)
+                if pr["state"] != "OPEN":
+                    pending.remove((repo, number))
+                    results[(repo, number)] = [f"{pr['state'].lower()} while waiting"]
+                elif not ci_pending(pr):
+                    pending.remove((repo, number))
+                    waited[(repo, number)] = time.monotonic() - started
+                    settled[(repo, number)] = plan_pr(
+                        repo, owners_map[repo], pr, settings
+                    )
+        apply_plans([plan for plan in settled.values() if plan], settings)
+        for key, plan in settled.items():
+            results[key] = plan_actions(plan)
+        if settled:
+            interval = settings["wait_interval"]
+        else:
+            interval = min(interval * 1.5, MAX_WAIT_INTERVAL)
+
+    print(f"Waited {time.monotonic() - started:.0f}s for CI with {polls} polls:")
+    for (repo, number), seconds in waited.items():
+        print(f"  {repo} PR #{number} settled after {seconds:.0f}s")
+    for repo, number in pending:
+        print(f"  {repo} PR #{number} still pending, giving up")
+        results[(repo, number)] = ["checks still pending"]
+    return results
+
+
+# Function to get the repo and the numbers of the PRs a webhook event is about
+def event_prs(event, payload):
+    repo = payload.get("repository", {}).get("full_name")
+    if event == "pull_request":
+        if payload.get("action") not in PR_ACTIONS:
+            return repo, []
+        return repo, [payload["pull_request"]["number"]]
+    if event == "check_suite":
+        if payload.get("action") != "completed":
+            return repo, []
+        return repo, [pr["number"] for pr in payload["check_suite"]["pull_requests"]]
+    if event == "status":
+        if payload.get("state") == "pending":
+            return repo, []
+        try:
+            prs = get_client().get(f"repos/{repo}/commits/{payload['sha']}/pulls")
+        except GitHubError as e:
+            print(f"Error finding the PRs of commit {payload['sha']} in {repo}: {e}")
+            return repo, []
+        return repo, [pr["number"] for pr in prs if pr["state"] == "open"]
+    return repo, []
+
+
+# Function to review the PRs a webhook event is about
+def handle_event(event, payload, reposmap, settings):
+    repo, pr_numbers = event_prs(event, payload)
+    if repo not in reposmap or not pr_numbers:
+        return
+    print(f"Received {event} event for {repo} PRs {pr_numbers}")
+    for pr_number in pr_numbers:
+        pr = fetch_pr(repo, pr_number)
+        if pr is None or pr["state"] != "OPEN":
+            continue
+        actions = process_pr(repo, reposmap[repo], pr, settings)
+        if actions:
+            print(f"{repo} PR #{pr_number}: {', '.join(actions)}")
 
 
 @click.command()
@@ -232,14 +709,117 @@ def all_files_in_tekton(files):
     default=False,
     help="set to true will check if PR has failed status checks",
 )
+@click.option(
+    "--wait-ci",
+    is_flag=True,
+    default=False,
+    help="set to true will wait for running checks to finish before commenting or approving",
+)
+@click.option(
+    "--wait-interval",
+    type=click.FloatRange(min=1),
+    default=30,
+    help="the initial number of seconds between two polls of the pending checks",
+)
+@click.option(
+    "--wait-timeout",
+    type=click.FloatRange(min=0),
+    default=3600,
+    help="the number of seconds to wait for the pending checks at most",
+)
 @click.option(
     "--extra-keyword",
     type=click.STRING,
     help="the extra keyword to search for in PR titles",
 )
+@click.option(
+    "--author",
+    "authors",
+    multiple=True,
+    help="only review the PRs of this author, can be given multiple times",
+)
+@click.option(
+    "--base-branch",
+    "bases",
+    multiple=True,
+    help="only review the PRs targeting this branch, can be given multiple times",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="set to true will not use the on-disk cache of GitHub responses",
+)
+@click.option(
+    "--no-ledger",
+    is_flag=True,
+    default=False,
+    help="set to true will not skip the PRs already handled at the same head commit and checks",
+)
+@click.option(
+    "--serve",
+    is_flag=True,
+    default=False,
+    help="set to true will run a webhook receiver and only review the PRs of the received events",
+)
+@click.option(
+    "--host",
+    type=click.STRING,
+    default="127.0.0.1",
+    help="the address of the webhook receiver to listen on, e.g. 0.0.0.0 to accept the deliveries from GitHub directly, which requires --webhook-secret",
+)
+@click.option(
+    "--port",
+    type=click.INT,
+    default=8080,
+    help="the port of the webhook receiver",
+)
+@click.option(
+    "--webhook-secret",
+    type=click.STRING,
+    envvar="PRREVIEW_WEBHOOK_SECRET",
+    help="the secret to verify the webhook deliveries with",
+)
+@click.option(
+    "--plan-only",
+    is_flag=True,
+    default=False,
+    help="set to true will only print the planned changes of the PRs without applying them",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="the number of repos to process concurrently, the PRs of a repo are processed one by one",
+)
 # Main function to list and modify PRs
-# Example usage: python -m apps.konflux.prreview --approve --seedling --extra-keyword="Konflux Test" stolostron/ocm stolostron/managed-serviceaccount
-def main(repos, approve, seedling, check_status, extra_keyword):
+# Example usage: python -m apps.konflux.prreview --approve --seedling --extra-keyword="Konflux Test" --jobs=4 stolostron/ocm stolostron/managed-serviceaccount
+# Example usage: python -m apps.konflux.prreview --serve --host=0.0.0.0 --port=8080 --webhook-secret=$SECRET --approve --check-status
+# Example usage: python -m apps.konflux.prreview --approve --seedling --plan-only
+def main(
+    repos,
+    approve,
+    seedling,
+    check_status,
+    wait_ci,
+    wait_interval,
+    wait_timeout,
+    extra_keyword,
+    authors,
+    bases,
+    no_cache,
+    no_ledger,
+    serve,
+    host,
+    port,
+    webhook_secret,
+    plan_only,
+    jobs,
+):
+    if no_cache:
+        disable_cache()
+    # Waiting for the checks only makes sense to act on their results
+    check_status = check_status or wait_ci
     # TODO: update every release starts
     branches_before_changing = ["backplane-2.8", "release-2.13"]
     branch_after_changing = "main"
@@ -276,50 +856,77 @@ def main(repos, approve, seedling, check_status, extra_keyword):
             )
             return
 
-    for repo, owners in reposmap.items():
-        prs = list_prs(repo)
-        for pr in prs:
-            title_match = False
-            content_match = False
-            # Check if all files changed are in the ".tekton" directory, and comment "/lgtm" if true
-            changed_files = get_changed_files(repo, pr["number"])
-            if all_files_in_tekton(changed_files):
-                content_match = True
-            if any(keyword in pr["title"] for keyword in keywords):
-                title_match = True
-            print(
-                f"PR #{pr['number']} in {repo}, content_match: {content_match}, title_match: {title_match}, title: {pr['title']}"
+    settings = {
+        "keywords": keywords,
+        "authors": list(authors),
+        "bases": list(bases),
+        "branches_before_changing": branches_before_changing,
+        "branch_after_changing": branch_after_changing,
+        "approve": approve,
+        "seedling": seedling,
+        "check_status": check_status,
+        "jobs": jobs,
+        "wait_ci": wait_ci,
+        "wait_interval": wait_interval,
+        "wait_timeout": wait_timeout,
+        "ledger": None if no_ledger else ActionLedger(),
+        "plan_only": plan_only,
+    }
+    if serve:
+        try:
+            server = WebhookServer(
+                lambda event, payload: handle_event(event, payload, reposmap, settings),
+                host=host,
+                port=port,
+                secret=webhook_secret,
             )
-            if title_match and content_match:
-                if pr["baseRefName"] in branches_before_changing:
-                    if pr["baseRefName"] == branch_after_changing:
-                        print(
-                            f"PR #{pr['number']} in {repo} already targets {branch_after_changing}. Skipping."
-                        )
-                    else:
-                        print(
-                            f"PR #{pr['number']} in {repo} targets {pr['baseRefName']}. Changing to {branch_after_changing}."
-                        )
-                        change_base_branch(repo, pr["number"], branch_after_changing)
-
-                if seedling:
-                    # Check if the PR title starts with ":seeding:" and update it if not
-                    update_pr_title(repo, pr["number"], pr["title"])
-
-                ci_failed = False
-                if check_status:
-                    # Check if the PR has any failed status checks
-                    ci_failed = check_failed_status(repo, pr["number"], owners)
-
-                if approve and not ci_failed:
-                    lgtm, approved = has_lgtm_and_approved_labels(repo, pr["number"])
-                    if lgtm and approved:
-                        print(
-                            f"PR #{pr['number']} in {repo} already has 'lgtm' and 'approved' labels. Skipping."
-                        )
-                    else:
-                        print(f"Approving PR #{pr['number']} in {repo}.")
-                        comment_lgtm_approve(repo, pr["number"])
+        except ValueError as e:
+            raise click.UsageError(f"{e}, set --webhook-secret")
+        server.serve_forever()
+        return
+
+    # Plan the changes of all PRs of all repos first, then apply them in batches
+    planned = run_grouped(
+        lambda item: plan_repo(item[0], item[1], settings),
+        reposmap.items(),
+        jobs,
+    )
+    plans = [plan for repo_plans in planned for _, plan in repo_plans if plan]
+    if plan_only:
+        print("Plan:")
+        for plan in plans:
+            actions = plan_actions(plan, planned=True)
+            if actions:
+                print(
+                    f"  {plan['repo']} PR #{plan['pr']['number']}: {', '.join(actions)}"
+                )
+        return
+    apply_plans(plans, settings)
+    reports = [
+        [(pr, plan_actions(plan)) for pr, plan in repo_plans] for repo_plans in planned
+    ]
+
+    if wait_ci:
+        pending = [
+            (repo, pr["number"])
+            for repo, repo_reports in zip(reposmap, reports)
+            for pr, actions in repo_reports
+            if WAITING_FOR_CI in actions
+        ]
+        settled = wait_for_ci(pending, reposmap, settings)
+        for repo, repo_reports in zip(reposmap, reports):
+            for pr, actions in repo_reports:
+                if WAITING_FOR_CI in actions:
+                    actions.remove(WAITING_FOR_CI)
+                    actions += settled[(repo, pr["number"])]
+
+    print("Summary:")
+    for repo, repo_reports in zip(reposmap, reports):
+        for pr, actions in repo_reports:
+            if actions:
+                print(f"  {repo} PR #{pr['number']}: {', '.join(actions)}")
+
+    print(get_client().scheduler.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import re
+
+from apps.konflux.ghclient import get_client
+
+KONFLUX_BOT = "app/red-hat-konflux"
+
+# GraphQL query to search PRs, the PR fields are filled in by search_pull_requests
+SEARCH_QUERY = """
+query($query: String!, $cursor: String) {
+  search(query: $query, type: ISSUE, first: 50, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on PullRequest {
+        repository { nameWithOwner }
+%s
+      }
+    }
+  }
+}
+"""
+
+
+# Function to get the words every keyword contains. GitHub search matches words
+# case-insensitively, so these can filter titles on the server, the exact
+# case-sensitive keyword match is still done locally.
+def common_title_terms(keywords):
+    terms = None
+    for keyword in keywords:
+        words = set(re.findall(r"[a-z0-9]+", keyword.lower()))
+        terms = words if terms is None else terms & words
+    return sorted(terms or [])
+
+
+# Function to build the search queries of open PRs, one per author and base branch
+def build_pr_search_queries(repos, authors=None, title_terms=None, bases=None):
+    queries = []
+    for author in authors or [None]:
+        for base in bases or [None]:
+            parts = [f"repo:{repo}" for repo in repos]
+            parts += ["is:pr", "is:open", "sort:created-desc"]
+            if author:
+                parts.append(f"author:{author}")
+            if base:
+                parts.append(f"base:{base}")
+            if title_terms:
+                parts += list(title_terms) + ["in:title"]
+            queries.append(" ".join(parts))
+    return queries
+
+
+# Function to run the search queries with complete cursor pagination, returns the
+# PR nodes with the given GraphQL fields (which must include "number") and their
+# "repository", without duplicates
+def search_pull_requests(queries, fields):
+    client = get_client()
+    prs = {}
+    for query in queries:
+        cursor = None
+        while True:
+            data = client.graphql(
+                SEARCH_QUERY % fields, {"query": query, "cursor": cursor}
+            )
+            for node in data["search"]["nodes"]:
+                if not node:
+                    continue
+                key = (node["repository"]["nameWithOwner"], node["number"])
+                prs.setdefault(key, node)
+            if not data["search"]["pageInfo"]["hasNextPage"]:
+                break
+            cursor = data["search"]["pageInfo"]["endCursor"]
+    return list(prs.values())
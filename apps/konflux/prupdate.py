@@ -1,15 +1,36 @@
+import base64
+import io
 import subprocess
 import os
+import threading
 import click
-import os
-from ruamel.yaml import YAML
-import json
+from ruamel.yaml import __version__ as ruamel_yaml_version
+
+from apps.common.cachedir import cache_dir
+from apps.common.gitmirror import fetch_from_mirror
+from apps.common.gitnarrow import narrow_fetch
+from apps.common.gitplumbing import (
+    CatFileBatch,
+    advance_branch,
+    commit_changes,
+    git,
+    rebase_state,
+    rev_parse,
+)
+from apps.common.runcache import RunCache
+from apps.common.workspace import clone_workspace
+from apps.common.yamlcache import CanonicalYAMLCache
+from apps.common.yamlparser import YAML_SETTINGS, get_yaml
+from apps.konflux.ghclient import GitHubError, get_client
+from apps.konflux.httpcache import HTTPCache
+from apps.konflux.pushqueue import PushQueue
+from apps.konflux.workers import run, run_grouped
+
+_canonical_cache = None
+_canonical_lock = threading.Lock()
+_blob_cache = None
+_blob_lock = threading.Lock()
 
-# Initialize YAML parser
-yaml = YAML()
-yaml.preserve_quotes = True
-yaml.width = 256
-yaml.indent(mapping=2, sequence=2, offset=0)
 
 # TODO: update every release starts
 acm_mce_release = ["release-2.13", "backplane-2.8"]
@@ -19,65 +40,28 @@ def local_branch_name(from_branch, to_branch):
     return f"konflux_update_{from_branch}_{to_branch}"
 
 
-# Function to check if the "upstream" remote exists, if not, add it
-def check_upstream_remote(repo_dir, upstream_url):
-    try:
-        # Check if the upstream remote already exists
-        result = subprocess.run(
-            ["git", "-C", repo_dir, "remote", "get-url", "upstream"],
-            capture_output=True,
-            text=True,
-        )
-
-        # If the upstream remote does not exist, the command will fail
-        if result.returncode != 0:
-            print(f"Upstream remote not found. Adding upstream remote: {upstream_url}")
-            subprocess.run(
-                ["git", "-C", repo_dir, "remote", "add", "upstream", upstream_url],
-                check=True,
-            )
-        else:
-            print("Upstream remote already exists.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking or adding upstream remote: {e}")
-
-
-# Function to create a new branch, commit changes, and push the branch
-def checkout_or_rebase_branch(repo_dir, from_branch, to_branch, push_rebase):
+# Function to checkout the branch to update, created from upstream/<to_branch>
+# if it does not exist yet. An existing branch is only rebased if it is behind
+# upstream and the rebase does not conflict, which is told without touching the
+# worktree. With push_rebase, a moved branch is queued to be pushed. Returns
+# the state of the branch: "created", "up to date", "fast-forward", "rebased"
+# or "conflict", in which case the branch is left as it is.
+def checkout_or_rebase_branch(repo_dir, from_branch, to_branch, push_rebase, queue):
     local_branch = local_branch_name(from_branch, to_branch)
+    upstream_branch = f"upstream/{to_branch}"
     # Check if the branch exists locally
-    result = subprocess.run(
+    result = run(
         ["git", "-C", repo_dir, "rev-parse", "--verify", local_branch],
         capture_output=True,
         text=True,
     )
 
-    if result.returncode == 0:
-        # Branch exists locally, perform rebase
-        print(
-            f"Branch {local_branch} exists locally. Rebasing with upstream/{to_branch}..."
-        )
-        rebase_result = subprocess.run(
-            ["git", "-C", repo_dir, "rebase", f"upstream/{to_branch}", local_branch],
-            check=True,
-        )
-        # Check if there are any changes to push
-        if rebase_result.returncode == 0 and push_rebase:
-            # check if the return message contains "Successfully rebased and updated"
-            if "Successfully rebased and updated" in rebase_result.stdout:
-                print(f"Successfully rebased {local_branch} with upstream/{to_branch}.")
-                subprocess.run(
-                    ["git", "-C", repo_dir, "push", "-u", "origin", local_branch, "-f"],
-                    check=True,
-                )
-        else:
-            print(f"Error rebasing {local_branch} with upstream/{to_branch}.")
-    else:
+    if result.returncode != 0:
         # Branch does not exist, create and checkout new branch
         print(
             f"Branch {local_branch} does not exist locally. Creating and checking out..."
         )
-        subprocess.run(
+        run(
             [
                 "git",
                 "-C",
@@ -85,155 +69,73 @@ def checkout_or_rebase_branch(repo_dir, from_branch, to_branch, push_rebase):
                 "checkout",
                 "-b",
                 local_branch,
-                f"upstream/{to_branch}",
+                upstream_branch,
             ],
             check=True,
         )
+        return "created"
 
-
-# Function to clone a repo from the forked repository
-def clone_repo_from_fork(
-    repo, fork_user, repo_dir, from_branch, to_branch, push_rebase
-):
-    # Construct the URL for the forked repository
-    forked_repo_url = f"git@github.com:{fork_user}/{repo.split('/')[1]}.git"
-    if not os.path.exists(repo_dir):
-        print(f"Cloning {forked_repo_url} into {repo_dir}...")
-        subprocess.run(["git", "clone", forked_repo_url, repo_dir], check=True)
-    # else:
-    #     print(f"Repository {repo_dir} already exists. Pulling latest changes...")
-    #     subprocess.run(['git', '-C', repo_dir, 'pull'], check=True)
-
-    # Add the original repository as the upstream remote
-    original_repo_url = f"git@github.com:{repo}.git"
-    check_upstream_remote(repo_dir, original_repo_url)
-
-    subprocess.run(["git", "-C", repo_dir, "fetch", "upstream"], check=True)
-
-    checkout_or_rebase_branch(repo_dir, from_branch, to_branch, push_rebase)
-
-
-# Function to format a YAML file
-def format_yaml_file(file_path):
-    with open(file_path, "r") as f:
-        data = yaml.load(f)
-
-    # Save changes to the YAML file
-    with open(file_path, "w") as f:
-        yaml.dump(data, f)
-
-
-# Function to format all *.yaml files in the .tekton folder
-def format_tekton_files(repo_dir, from_branch, to_branch, dry_run=False):
-    tekton_dir = os.path.join(repo_dir, ".tekton")
-    if not os.path.exists(tekton_dir):
-        print(f"No .tekton directory found in {repo_dir}. Skipping...")
-        return ""
-
-    # Iterate through the files in the .tekton directory
-    for root, dirs, files in os.walk(tekton_dir):
-        for file in files:
-            if not file.endswith(".yaml"):
-                continue
-
-            file_path = os.path.join(root, file)
-            format_yaml_file(file_path)
-
-    if not has_changes(repo_dir):
+    # Branch exists locally, check what a rebase would do before touching the worktree
+    state = rebase_state(repo_dir, local_branch, upstream_branch)
+    if state == "conflict":
         print(
-            f"No changes for formatting tekton files to commit in {repo_dir}. Skipping..."
+            f"Branch {local_branch} conflicts with {upstream_branch}. Skipping the rebase..."
         )
-        return ""
-    message = "Formatting all tekton files"
-    commit_and_push_changes(repo_dir, from_branch, to_branch, message, dry_run)
-    return message
-
+        return state
 
-# Function to find and replace branch in .tekton files
-def update_tekton_files(repo_dir, from_branch, to_branch, dry_run=False):
-    tekton_dir = os.path.join(repo_dir, ".tekton")
-    if not os.path.exists(tekton_dir):
-        print(f"No .tekton directory found in {repo_dir}. Skipping...")
-        return ""
-
-    # Iterate through the files in the .tekton directory
-    for root, dirs, files in os.walk(tekton_dir):
-        for file in files:
-            if not file.endswith(".yaml"):
-                continue
-
-            file_path = os.path.join(root, file)
-            with open(file_path, "r") as f:
-                content = f.read()
-
-            # Replace from_branch with to_branch
-            source = f'target_branch == "{from_branch}"'
-            target = f'target_branch == "{to_branch}"'
-            if source in content:
-                print(f"Updating {file_path}...")
-                updated_content = content.replace(source, target)
-                with open(file_path, "w") as f:
-                    f.write(updated_content)
-
-    if not has_changes(repo_dir):
-        print(f"No changes to commit in {repo_dir}. Skipping...")
-        return ""
-    message = f"Update konflux CEL from {from_branch} to {to_branch}"
-    commit_and_push_changes(repo_dir, from_branch, to_branch, message, dry_run)
-    return message
-
-
-# Function to delete unnecessary files in the .tekton directory
-def purge_tekton_files(repo_dir, from_branch, to_branch, dry_run=False):
-    tekton_dir = os.path.join(repo_dir, ".tekton")
-    if not os.path.exists(tekton_dir):
-        print(f"No .tekton directory found in {repo_dir}. Skipping...")
-        return ""
-
-    # Iterate through the files in the .tekton directory
-    for root, dirs, files in os.walk(tekton_dir):
-        for file in files:
-            if not file.endswith(".yaml"):
-                continue
-
-            file_path = os.path.join(root, file)
-            with open(file_path, "r") as f:
-                content = f.read()
-
-            releases = [to_branch]
-            if to_branch == "main":
-                releases += acm_mce_release
-
-            # keep the file if any of the releases is in the file
-            if any(f'target_branch == "{release}"' in content for release in releases):
-                print(f"Keeping {file_path}...")
-                continue
-            os.remove(file_path)
-
-    if not has_changes(repo_dir):
-        print(f"No changes to commit in {repo_dir}. Skipping...")
-        return ""
-    message = f"Purge konflux files"
-    commit_and_push_changes(repo_dir, from_branch, to_branch, message, dry_run)
-    return message
+    run(["git", "-C", repo_dir, "checkout", "--quiet", local_branch], check=True)
+    if state == "up to date":
+        print(f"Branch {local_branch} is up to date with {upstream_branch}.")
+        return state
 
+    if state == "fast-forward":
+        print(f"Fast-forwarding {local_branch} to {upstream_branch}...")
+        run(
+            ["git", "-C", repo_dir, "merge", "--ff-only", "--quiet", upstream_branch],
+            check=True,
+        )
+    else:
+        print(
+            f"Branch {local_branch} exists locally. Rebasing with {upstream_branch}..."
+        )
+        rebase_result = run(["git", "-C", repo_dir, "rebase", upstream_branch])
+        if rebase_result.returncode != 0:
+            # The commits of the branch conflict with each other on top of upstream
+            print(f"Error rebasing {local_branch} with {upstream_branch}.")
+            run(["git", "-C", repo_dir, "rebase", "--abort"])
+            return "conflict"
+        state = "rebased"
+
+    print(f"Successfully rebased {local_branch} with {upstream_branch}.")
+    if push_rebase:
+        queue.add(repo_dir, "origin", local_branch, local_branch, force=True)
+    return state
+
+
+# Function to clone a repo from the forked repository, add the upstream remote
+# and fetch its branches. A narrow workspace only fetches the given branches.
+def prepare_workspace(repo, fork_user, repo_dir, branches, narrow=False):
+    mirror = clone_workspace(repo, fork_user, repo_dir, narrow, run=run)
+    if narrow:
+        narrow_fetch(repo_dir, "upstream", branches, run=run)
+    else:
+        fetch_from_mirror(repo_dir, mirror, run=run)
 
-def create_owners_file(repo_dir, from_branch, to_branch, dry_run=False):
-    # Check if .tekton folder exists
-    if not os.path.exists(os.path.join(repo_dir, ".tekton")):
-        print(f"No .tekton directory found in {repo_dir}. Skipping...")
-        return
 
-    # Define the path to the OWNERS file in the .tekton directory
-    owners_file_path = os.path.join(repo_dir, ".tekton", "OWNERS")
+# Function to clone a repo from the forked repository and checkout the branch to
+# update, returns the state of the branch, see checkout_or_rebase_branch
+def clone_repo_from_fork(
+    repo, fork_user, repo_dir, from_branch, to_branch, push_rebase, queue, narrow=False
+):
+    prepare_workspace(repo, fork_user, repo_dir, [from_branch, to_branch], narrow)
+    return checkout_or_rebase_branch(
+        repo_dir, from_branch, to_branch, push_rebase, queue
+    )
 
-    # Check if the OWNERS file exists
-    if os.path.exists(owners_file_path):
-        return
 
-    print(f"OWNERS file does not exist. Creating {owners_file_path}.")
-    # Define the content of the OWNERS file
-    owners_content = """approvers:
+# The OWNERS file created in the .tekton folder
+OWNERS_PATH = ".tekton/OWNERS"
+OWNERS_CONTENT = """approvers:
 - zhujian7
 - zhiweiyin318
 - haoqing0110
@@ -249,66 +151,320 @@ reviewers:
 - xuezhaojun
 - qiujian16
 """
-    # Create the .tekton directory if it doesn't exist
-    os.makedirs(os.path.dirname(owners_file_path), exist_ok=True)
 
-    # Write the content to the OWNERS file
-    with open(owners_file_path, "w") as f:
-        f.write(owners_content)
 
-    print("OWNERS file created successfully.")
-    message = f"Create an OWNERS file for tekton files"
-    commit_and_push_changes(repo_dir, from_branch, to_branch, message, dry_run)
-    return message
+# Function to get the cache of the canonically formatted YAML contents, shared by all threads
+def get_canonical_cache():
+    global _canonical_cache
+    with _canonical_lock:
+        if _canonical_cache is None:
+            _canonical_cache = CanonicalYAMLCache(
+                dict(YAML_SETTINGS, ruamel_yaml=ruamel_yaml_version)
+            )
+        return _canonical_cache
+
+
+# Function to format the content of a YAML file. Contents already known to be
+# canonically formatted are returned as they are, without the slow round trip.
+def format_yaml_content(content):
+    cache = get_canonical_cache()
+    if cache.is_canonical(content):
+        return content
+    yaml = get_yaml()
+    data = yaml.load(content)
+    stream = io.StringIO()
+    yaml.dump(data, stream)
+    formatted = stream.getvalue()
+    if formatted == content:
+        cache.add(content)
+    return formatted
+
+
+# Function to load the *.yaml files of the .tekton folder of a commit straight
+# from the object database through a CatFileBatch. Returns {path relative to the
+# repo: content} and whether .tekton/OWNERS exists, or None if there is no .tekton folder.
+def load_tekton_files(batch, rev):
+    entries = batch.list_tree(f"{rev}:.tekton", ".tekton/")
+    if entries is None:
+        return None
+    files = {
+        path: batch.read(sha)[1].decode()
+        for path, (_, sha) in entries.items()
+        if path.endswith(".yaml")
+    }
+    return files, OWNERS_PATH in entries
+
+
+# Function to format all *.yaml files
+def format_tekton_files(files):
+    return {path: format_yaml_content(content) for path, content in files.items()}
+
+
+# Function to find and replace branch in the CEL of the files
+def update_tekton_files(files, from_branch, to_branch):
+    source = f'target_branch == "{from_branch}"'
+    target = f'target_branch == "{to_branch}"'
+    updated = {}
+    for path, content in files.items():
+        if source in content:
+            print(f"Updating {path}...")
+            content = content.replace(source, target)
+        updated[path] = content
+    return updated
+
+
+# Function to drop the unnecessary *.yaml files, a file is kept if it is for any of the releases
+def purge_tekton_files(files, to_branch):
+    releases = [to_branch]
+    if to_branch == "main":
+        releases += acm_mce_release
+    kept = {}
+    for path, content in files.items():
+        if not path.endswith(".yaml"):
+            kept[path] = content
+        elif any(f'target_branch == "{release}"' in content for release in releases):
+            print(f"Keeping {path}...")
+            kept[path] = content
+    return kept
+
+
+# Function to run all steps on the tekton files in memory: format, CEL update,
+# OWNERS file and purge. files is {path relative to the repo: content} of the
+# *.yaml files and has_owners tells if .tekton/OWNERS exists. Returns the steps
+# that changed something as (message, files after the step) pairs, in order.
+# The purged files are left out of the files, a created OWNERS file is added.
+def transform_tekton_files(files, from_branch, to_branch, has_owners):
+    steps = []
+
+    formatted = format_tekton_files(files)
+    if formatted != files:
+        steps.append(("Formatting all tekton files", formatted))
+
+    updated = update_tekton_files(formatted, from_branch, to_branch)
+    if updated != formatted:
+        steps.append((f"Update konflux CEL from {from_branch} to {to_branch}", updated))
+
+    if not has_owners:
+        print(f"OWNERS file does not exist. Creating {OWNERS_PATH}.")
+        updated = dict(updated, **{OWNERS_PATH: OWNERS_CONTENT})
+        steps.append(("Create an OWNERS file for tekton files", updated))
+
+    kept = purge_tekton_files(updated, to_branch)
+    if kept != updated:
+        steps.append(("Purge konflux files", kept))
+    return steps
+
+
+# Function to list the files of the .tekton folder of a branch through the GitHub
+# API, returns {path relative to the repo: blob sha}, or None if there is no .tekton folder
+def list_remote_tekton_files(repo, branch):
+    client = get_client()
+    try:
+        entries = client.get(f"repos/{repo}/contents/.tekton", {"ref": branch})
+    except GitHubError as e:
+        if e.status == 404:
+            return None
+        raise
+    files = {}
+    for entry in entries:
+        if entry["type"] == "file":
+            files[entry["path"]] = entry["sha"]
+        elif entry["type"] == "dir":
+            tree = client.get(
+                f"repos/{repo}/git/trees/{entry['sha']}", {"recursive": 1}
+            )
+            for item in tree["tree"]:
+                if item["type"] == "blob":
+                    files[f"{entry['path']}/{item['path']}"] = item["sha"]
+    return files
+
+
+# Function to get the cache of the blobs read through the GitHub API, shared by
+# all threads, None if the HTTP cache is turned off
+def get_blob_cache():
+    global _blob_cache
+    with _blob_lock:
+        if _blob_cache is None and get_client().cache is not None:
+            _blob_cache = HTTPCache(cache_dir("blobs"))
+        return _blob_cache
+
+
+# Function to read a blob through the GitHub API. A blob is addressed by its
+# content, so a cached one is returned by sha without any request.
+def read_remote_blob(repo, sha):
+    cache = get_blob_cache()
+    entry = cache.get(sha) if cache else None
+    if entry:
+        return entry["content"]
+    blob = get_client().request("GET", f"repos/{repo}/git/blobs/{sha}")
+    content = base64.b64decode(blob["content"]).decode()
+    if cache:
+        cache.put(sha, {"content": content})
+    return content
+
+
+# Function to tell, without cloning, if updating the tekton files of the target
+# branch would change anything. The same steps run on the .tekton folder of
+# upstream read through the GitHub API. If it can not be read, the repo is
+# assumed to need an update.
+def needs_update(repo, from_branch, to_branch):
+    print(f"Prechecking the .tekton folder of {repo} {to_branch}...")
+    try:
+        remote_files = list_remote_tekton_files(repo, to_branch)
+        if remote_files is None:
+            print(f"No .tekton directory found in {repo} {to_branch}.")
+            return False
+        files = {
+            path: read_remote_blob(repo, sha)
+            for path, sha in remote_files.items()
+            if path.endswith(".yaml")
+        }
+    except GitHubError as e:
+        print(f"Error prechecking {repo}, updating it anyway: {e}")
+        return True
+    steps = transform_tekton_files(
+        files, from_branch, to_branch, OWNERS_PATH in remote_files
+    )
+    return bool(steps)
 
 
-def has_changes(repo_dir):
-    result = subprocess.run(
-        ["git", "-C", repo_dir, "diff", "--exit-code", "--quiet"],
+# Function to update the tekton files on the checked out branch of a repo. The
+# .tekton folder is read from the head commit, all steps run in memory, and each
+# step becomes one commit built with git plumbing from the changed blobs only, so
+# the rest of the repo is never scanned. The push of the branch is queued.
+# Returns the messages of the steps that changed something, for the PR body.
+def update_konflux_files(repo_dir, from_branch, to_branch, queue):
+    local_branch = local_branch_name(from_branch, to_branch)
+    head = rev_parse(repo_dir, "HEAD")
+    with CatFileBatch(repo_dir) as batch:
+        loaded = load_tekton_files(batch, head)
+    if loaded is None:
+        print(f"No .tekton directory found in {repo_dir}. Skipping...")
+        return []
+
+    files, has_owners = loaded
+    steps = transform_tekton_files(files, from_branch, to_branch, has_owners)
+    if not steps:
+        print(f"No changes to commit in {repo_dir}. Skipping...")
+        return []
+
+    commit = commit_steps(repo_dir, local_branch, head, files, steps)
+    advance_branch(repo_dir, local_branch, head, commit)
+
+    push_changes(queue, repo_dir, from_branch, to_branch)
+    return [message for message, _ in steps]
+
+
+# Function to commit each step on top of the previous one, starting from the
+# parent commit whose tekton files are files. Returns the last commit.
+def commit_steps(repo_dir, local_branch, parent, files, steps):
+    commit = parent
+    previous = files
+    for message, step_files in steps:
+        changes = {
+            path: content.encode()
+            for path, content in step_files.items()
+            if previous.get(path) != content
+        }
+        changes.update({path: None for path in previous if path not in step_files})
+        commit = commit_changes(repo_dir, commit, changes, message)
+        print(f"[{local_branch} {commit[:7]}] {message}")
+        previous = step_files
+    return commit
+
+
+# Function to update the tekton files of one from/to branch pair without a
+# checkout, the .tekton folders are read through the batch. An existing local
+# branch is kept when it is up to date with upstream/<to_branch>, the new commits
+# go on top of it. Otherwise the commits are built on top of upstream/<to_branch>,
+# which is what a rebase of the branch gives, unless it conflicts. The branch is
+# set with update-ref and its push is queued only if its .tekton folder changed,
+# or, with push_rebase, if it moved. Returns the state of the pair and the messages of the
+# steps: "updated", "unchanged" (the existing branch has nothing new to push),
+# "no changes" (there is no branch and nothing to change) or "rebase conflict".
+def update_konflux_branch(repo_dir, batch, from_branch, to_branch, push_rebase, queue):
+    local_branch = local_branch_name(from_branch, to_branch)
+    upstream_branch = f"upstream/{to_branch}"
+    result = run(
+        ["git", "-C", repo_dir, "rev-parse", "--verify", f"refs/heads/{local_branch}"],
         capture_output=True,
         text=True,
     )
-    return result.returncode != 0
+    existing = result.stdout.strip() if result.returncode == 0 else None
 
-
-# Function to create a new branch, commit changes, and push the branch
-def commit_and_push_changes(repo_dir, from_branch, to_branch, message, dry_run=False):
-    subprocess.run(["git", "-C", repo_dir, "add", "."], check=True)
-    subprocess.run(
-        ["git", "-C", repo_dir, "commit", "--signoff", "-m", message], check=True
+    base = rev_parse(repo_dir, upstream_branch)
+    if existing:
+        state = rebase_state(repo_dir, existing, base)
+        if state == "conflict":
+            print(
+                f"Branch {local_branch} conflicts with {upstream_branch}. Skipping..."
+            )
+            return "rebase conflict", []
+        if state == "up to date":
+            base = existing
+
+    loaded = load_tekton_files(batch, base)
+    if loaded is None:
+        print(f"No .tekton directory found in {upstream_branch}. Skipping...")
+        return ("unchanged" if existing else "no changes"), []
+    files, has_owners = loaded
+    steps = transform_tekton_files(files, from_branch, to_branch, has_owners)
+    if not steps and not existing:
+        print(f"No changes to commit for {upstream_branch}. Skipping...")
+        return "no changes", []
+
+    commit = commit_steps(repo_dir, local_branch, base, files, steps)
+    if commit == existing:
+        print(f"Branch {local_branch} is up to date with {upstream_branch}.")
+        return "unchanged", []
+    git(repo_dir, "update-ref", f"refs/heads/{local_branch}", commit)
+
+    # Only the .tekton folder matters to the PR, the rest follows upstream
+    changed = not existing or batch.read(f"{commit}:.tekton") != batch.read(
+        f"{existing}:.tekton"
     )
-    local_branch = local_branch_name(from_branch, to_branch)
+    if not changed and not push_rebase:
+        # The branch has the same tekton files, pushing it would only rerun the CI
+        print(f"Branch {local_branch} has no new changes. Skipping the push...")
+        return "unchanged", []
+    push_changes(queue, repo_dir, from_branch, to_branch)
+    return "updated", [message for message, _ in steps]
+
+
+# Function to update the tekton files of several from/to branch pairs at once, see
+# update_konflux_branch. The .tekton folders of all target branches are read
+# through one long-lived cat-file process and nothing is checked out. Errors
+# are reported per pair. Returns {pair: (state, messages of the steps)}.
+def update_konflux_branches(repo_dir, pairs, push_rebase, queue):
+    # The local branches are moved without the worktree, so none of them may stay checked out
+    git(repo_dir, "checkout", "--quiet", "--detach")
+    results = {}
+    with CatFileBatch(repo_dir) as batch:
+        for pair in pairs:
+            try:
+                results[pair] = update_konflux_branch(
+                    repo_dir, batch, *pair, push_rebase, queue
+                )
+            except subprocess.CalledProcessError as e:
+                print(f"Error updating upstream/{pair[1]}: {e}")
+                results[pair] = f"failed: {e}", []
+    return results
 
-    if dry_run:
-        print(f"DRY-RUN: Pushing changes to {local_branch}")
-        return
-    subprocess.run(
-        ["git", "-C", repo_dir, "push", "-u", "origin", local_branch, "-f"], check=True
-    )
+
+# Function to queue the force push of the branch, the queue pushes all branches of a workspace at once
+def push_changes(queue, repo_dir, from_branch, to_branch):
+    local_branch = local_branch_name(from_branch, to_branch)
+    queue.add(repo_dir, "origin", local_branch, local_branch, force=True)
 
 
-# Function to check if a PR already exists for the given branch, if exists, return the pr number
-def pr_exists(repo, from_branch, to_branch):
+# Function to check if a PR already exists for the given branch, if exists, return the pr url
+def pr_exists(repo, github_user, from_branch, to_branch):
     local_branch = local_branch_name(from_branch, to_branch)
     try:
-        result = subprocess.run(
-            [
-                "gh",
-                "pr",
-                "list",
-                "--repo",
-                repo,
-                "--head",
-                local_branch,
-                "--json",
-                "number",
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
+        prs = get_client().get(
+            f"repos/{repo}/pulls",
+            {"head": f"{github_user}:{local_branch}", "state": "open"},
         )
-
-        prs = json.loads(result.stdout.strip())
         if not prs:
             print(
                 f"PR does not exist for branch {local_branch} in {repo}. Proceeding with PR creation."
@@ -317,8 +473,8 @@ def pr_exists(repo, from_branch, to_branch):
         print(
             f"PR already exists for branch {local_branch} in {repo}. Skipping PR creation."
         )
-        return prs[0]["number"]
-    except subprocess.CalledProcessError as e:
+        return prs[0]["html_url"]
+    except GitHubError as e:
         print(f"Error checking for existing PRs in {repo}: {e}")
         return
 
@@ -326,27 +482,18 @@ def pr_exists(repo, from_branch, to_branch):
 # Function to comment "/cc" on a PR
 def comment_cc(repo, pr_number, owners):
     try:
-        # Using gh command to comment "/cc @user1 @user2" on the PR
+        # Comment "/cc @user1 @user2" on the PR
         owners_mention = " ".join([f"@{owner}" for owner in owners])
-        subprocess.run(
-            [
-                "gh",
-                "pr",
-                "comment",
-                str(pr_number),
-                "--repo",
-                repo,
-                "--body",
-                f"/cc {owners_mention}",
-            ],
-            check=True,
+        get_client().post(
+            f"repos/{repo}/issues/{pr_number}/comments",
+            {"body": f"/cc {owners_mention}"},
         )
         print(f"Successfully commented '/cc' on PR #{pr_number} in {repo}.")
-    except subprocess.CalledProcessError as e:
+    except GitHubError as e:
         print(f"Error commenting '/cc' on PR #{pr_number} in {repo}: {e}")
 
 
-# Function to create a PR and cc the owner to review
+# Function to create a PR and cc the owner to review, returns the url of the PR
 def create_pull_request(
     repo, github_user, from_branch, to_branch, messages, owners, dry_run=False
 ):
@@ -358,36 +505,249 @@ def create_pull_request(
     local_branch = local_branch_name(from_branch, to_branch)
     body = construct_pr_body(repo, from_branch, to_branch, messages)
     try:
-        result = subprocess.run(
-            [
-                "gh",
-                "pr",
-                "create",
-                "--repo",
-                repo,
-                "--head",
-                f"{github_user}:{local_branch}",
-                "--base",
-                to_branch,
-                "--title",
-                f":seedling: [{to_branch}] update konflux files",
-                "--body",
-                body,
-            ],
-            check=True,
+        pr = get_client().post(
+            f"repos/{repo}/pulls",
+            {
+                "head": f"{github_user}:{local_branch}",
+                "base": to_branch,
+                "title": f":seedling: [{to_branch}] update konflux files",
+                "body": body,
+            },
         )
-        # get PR number from the result
         print(
-            f"PR created successfully for {repo} with branch {local_branch}. stdout: {result}"
+            f"PR created successfully for {repo} with branch {local_branch}: {pr['html_url']}"
         )
-
-        pr_number = pr_exists(repo, from_branch, to_branch)
-        if pr_number:
-            comment_cc(repo, pr_number, owners)
-    except subprocess.CalledProcessError as e:
+        comment_cc(repo, pr["number"], owners)
+        return pr["html_url"]
+    except GitHubError as e:
         print(f"Error creating PR for {repo}: {e}")
 
 
+# Function to update one repo and create its PR, returns the url of the PR and the status
+def update_repo(repo, owners, settings):
+    github_user = settings["github_user"]
+    from_branch = settings["from_branch"]
+    to_branch = settings["to_branch"]
+    dry_run = settings["dry_run"]
+    repo_dir = os.path.join(
+        settings["tmp_dir"], repo.split("/")[1]
+    )  # Use repo name as directory name
+
+    # Step 0: Skip the repos with nothing to change before touching the disk
+    if settings["precheck"]:
+        if not needs_update(repo, from_branch, to_branch):
+            print(f"No changes for the tekton files of {repo}. Skipping...")
+            return "", "no changes"
+
+    # Step 1: Clone the repository from the forked version
+    queue = PushQueue(atomic=settings["atomic_push"])
+    state = clone_repo_from_fork(
+        repo,
+        github_user,
+        repo_dir,
+        from_branch,
+        to_branch,
+        settings["push_rebase"],
+        queue,
+        settings["narrow"],
+    )
+    # A conflicting branch is reported, the other repos go on
+    if state == "conflict":
+        return "", "rebase conflict"
+
+    # Step 2: Format, update the CEL, add the OWNERS file and purge the files in the .tekton folder
+    messages = update_konflux_files(repo_dir, from_branch, to_branch, queue)
+
+    # The rebased and the updated branch are pushed together, the PR needs the branch on the fork
+    if not all(queue.flush(dry_run).values()):
+        return "", "failed to push"
+
+    # Step 3: Create the PR if it does not exist yet
+    return open_pull_request(repo, owners, settings, from_branch, to_branch, messages)
+
+
+# Function to create the PR of a branch unless it exists, returns the url of the PR and the status
+def open_pull_request(repo, owners, settings, from_branch, to_branch, messages):
+    github_user = settings["github_user"]
+    dry_run = settings["dry_run"]
+    url = pr_exists(repo, github_user, from_branch, to_branch)
+    if url:
+        return url, "PR exists"
+    # If no PR exists, create one
+    url = create_pull_request(
+        repo, github_user, from_branch, to_branch, messages, owners, dry_run
+    )
+    if dry_run:
+        return "", "dry run"
+    return url or "", "PR created" if url else "failed to create PR"
+
+
+# Function to update several from/to branch pairs of one repo in one workspace,
+# returns {pair: (url of the PR, status)}
+def update_repo_branches(repo, owners, settings, pairs):
+    repo_dir = os.path.join(settings["tmp_dir"], repo.split("/")[1])
+    to_branches = [to_branch for _, to_branch in pairs]
+    prepare_workspace(
+        repo, settings["github_user"], repo_dir, to_branches, settings["narrow"]
+    )
+
+    queue = PushQueue(atomic=settings["atomic_push"])
+    updated = update_konflux_branches(repo_dir, pairs, settings["push_rebase"], queue)
+    pushed = queue.flush(settings["dry_run"])
+
+    results = {}
+    for pair, (state, messages) in updated.items():
+        if state == "updated":
+            if not pushed[(repo_dir, "origin", local_branch_name(*pair))]:
+                results[pair] = "", "failed to push"
+                continue
+        elif state != "unchanged":
+            results[pair] = "", state
+            continue
+        # An unchanged branch may already have its PR
+        results[pair] = open_pull_request(repo, owners, settings, *pair, messages)
+    return results
+
+
+# Function to get the commit of the tip of an upstream branch, returns None if it can not be fetched
+def upstream_head(repo, branch):
+    try:
+        return get_client().get(f"repos/{repo}/branches/{branch}")["commit"]["sha"]
+    except GitHubError as e:
+        print(f"Error fetching the head of {repo} {branch}: {e}")
+        return None
+
+
+# Function to get everything the outcome of a repo depends on besides its upstream branch
+def run_config(owners, settings):
+    return {
+        "github_user": settings["github_user"],
+        "from_branch": settings["from_branch"],
+        "to_branch": settings["to_branch"],
+        # A run with push_rebase also pushes the rebased branch
+        "push_rebase": settings["push_rebase"],
+        "acm_mce_release": acm_mce_release,
+        "owners": owners,
+        "owners_content": OWNERS_CONTENT,
+        "yaml": YAML_SETTINGS,
+    }
+
+
+# Function to get the outcome of the last successful run of a repo if its target
+# branch and config did not change since, returns the upstream commit and the outcome
+def lookup_run(repo, owners, settings):
+    upstream_sha = upstream_head(repo, settings["to_branch"])
+    outcome = settings["run_cache"].get(
+        repo, upstream_sha, run_config(owners, settings)
+    )
+    if outcome:
+        print(
+            f"{repo} {settings['to_branch']} did not change since the last run at {upstream_sha[:7]}. Skipping..."
+        )
+    return upstream_sha, outcome
+
+
+# Function to record the outcome of a successful run of a repo
+def record_run(repo, owners, settings, upstream_sha, url, status):
+    run_cache = settings["run_cache"]
+    if run_cache and status in ("no changes", "PR exists", "PR created"):
+        run_cache.put(
+            repo,
+            upstream_sha,
+            run_config(owners, settings),
+            {"url": url, "status": status},
+        )
+
+
+# Function to process one repo, returns the url of the PR and the status. A repo
+# whose target branch and config did not change since its last successful run is
+# skipped with the outcome of that run. Errors are reported in the status, so one
+# failing repo does not stop the others.
+def process_repo(repo, owners, settings):
+    upstream_sha = None
+    try:
+        if settings["run_cache"]:
+            upstream_sha, outcome = lookup_run(repo, owners, settings)
+            if outcome:
+                return outcome["url"], f"{outcome['status']} (cached)"
+
+        url, status = update_repo(repo, owners, settings)
+    except Exception as e:
+        print(f"Error updating {repo}: {e}")
+        return "", f"failed: {e}"
+
+    record_run(repo, owners, settings, upstream_sha, url, status)
+    return url, status
+
+
+# Function to process all from/to branch pairs of one repo, returns a list of
+# (label, (url of the PR, status)), one per pair. The run cache and the precheck
+# apply to each pair as in process_repo, the remaining pairs share one workspace.
+def process_repo_branches(repo, owners, settings):
+    results = {}
+    upstream_shas = {}
+    for pair in settings["branches"]:
+        pair_settings = dict(settings, from_branch=pair[0], to_branch=pair[1])
+        try:
+            upstream_shas[pair] = None
+            if settings["run_cache"]:
+                upstream_sha, outcome = lookup_run(repo, owners, pair_settings)
+                if outcome:
+                    results[pair] = outcome["url"], f"{outcome['status']} (cached)"
+                    upstream_shas.pop(pair)
+                    continue
+                upstream_shas[pair] = upstream_sha
+            if settings["precheck"] and not needs_update(repo, *pair):
+                print(
+                    f"No changes for the tekton files of {repo} {pair[1]}. Skipping..."
+                )
+                results[pair] = "", "no changes"
+        except Exception as e:
+            print(f"Error updating {repo} {pair[1]}: {e}")
+            results[pair] = "", f"failed: {e}"
+            upstream_shas.pop(pair)
+
+    pending = [pair for pair in upstream_shas if pair not in results]
+    if pending:
+        try:
+            results.update(update_repo_branches(repo, owners, settings, pending))
+        except Exception as e:
+            print(f"Error updating {repo}: {e}")
+            results.update({pair: ("", f"failed: {e}") for pair in pending})
+
+    for pair, upstream_sha in upstream_shas.items():
+        pair_settings = dict(settings, from_branch=pair[0], to_branch=pair[1])
+        record_run(repo, owners, pair_settings, upstream_sha, *results[pair])
+    return [
+        (f"{repo} {from_branch}->{to_branch}", results[(from_branch, to_branch)])
+        for from_branch, to_branch in settings["branches"]
+    ]
+
+
+# Function to print the PR url and status of every repo as a table
+def print_summary(results):
+    rows = [("REPO", "PR", "STATUS")]
+    rows += [(repo, url or "-", status) for repo, (url, status) in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    print("Summary:")
+    for row in rows:
+        print(f"  {row[0].ljust(widths[0])}  {row[1].ljust(widths[1])}  {row[2]}")
+
+
+# Function to parse the from:to branch pairs of the --branches option
+def parse_branch_pairs(ctx, param, values):
+    pairs = []
+    for value in values:
+        from_branch, sep, to_branch = value.partition(":")
+        if not sep or not from_branch or not to_branch:
+            raise click.BadParameter(
+                f"{value} is not in the form from_branch:to_branch"
+            )
+        pairs.append((from_branch, to_branch))
+    # The same pair twice would update the same branch twice
+    return list(dict.fromkeys(pairs))
+
+
 def construct_pr_body(repo, from_branch, to_branch, messages):
     pr_body = f"This PR:\n"
     for m in messages:
@@ -418,6 +778,12 @@ def construct_pr_body(repo, from_branch, to_branch, messages):
     default="main",
     help="The branch name of the konflux CEL to be updated to",
 )
+@click.option(
+    "--branches",
+    multiple=True,
+    callback=parse_branch_pairs,
+    help="from_branch:to_branch pairs to update in one pass, can be repeated, overrides --from_branch and --to_branch",
+)
 @click.option(
     "--push_rebase",
     is_flag=True,
@@ -430,7 +796,50 @@ def construct_pr_body(repo, from_branch, to_branch, messages):
     default=False,
     help="set to true will not create PR and push changes",
 )
-def main(repos, github_user, from_branch, to_branch, push_rebase, dry_run):
+@click.option(
+    "--atomic-push",
+    is_flag=True,
+    default=False,
+    help="set to true will push the branches of a repo atomically, all of them or none",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="the number of repos to update concurrently",
+)
+@click.option(
+    "--narrow",
+    is_flag=True,
+    default=False,
+    help="set to true will clone only the .tekton folder and fetch only the from/to branches",
+)
+@click.option(
+    "--no-precheck",
+    is_flag=True,
+    default=False,
+    help="set to true will clone and update the repos even if the GitHub API shows nothing to change",
+)
+@click.option(
+    "--no-run-cache",
+    is_flag=True,
+    default=False,
+    help="set to true will process the repos even if nothing changed since their last successful run",
+)
+def main(
+    repos,
+    github_user,
+    from_branch,
+    to_branch,
+    branches,
+    push_rebase,
+    dry_run,
+    atomic_push,
+    jobs,
+    narrow,
+    no_precheck,
+    no_run_cache,
+):
     reposmap = {
         # supportted repos, repo: owners
         "stolostron/ocm": ["zhujian7", "xuezhaojun"],
@@ -454,46 +863,50 @@ def main(repos, github_user, from_branch, to_branch, push_rebase, dry_run):
         # remove "stolostron/klusterlet-addon-controller" since its default branch is not backplane-*
         reposmap.pop("stolostron/klusterlet-addon-controller")
 
-    print(
-        f"Repos: {reposmap}, GitHub User: {github_user}, From Branch: {from_branch}, To Branch: {to_branch}"
-    )
+    if branches:
+        print(f"Repos: {reposmap}, GitHub User: {github_user}, Branches: {branches}")
+    else:
+        print(
+            f"Repos: {reposmap}, GitHub User: {github_user}, From Branch: {from_branch}, To Branch: {to_branch}"
+        )
 
     tmp_dir = "_tmp"
     # Ensure the temporary directory exists
     if not os.path.exists(tmp_dir):
         os.makedirs(tmp_dir)
 
-    # for repo in repos:
-    for repo, owners in reposmap.items():
-        repo_dir = os.path.join(
-            tmp_dir, repo.split("/")[1]
-        )  # Use repo name as directory name
-
-        # Step 1: Clone the repository from the forked version
-        clone_repo_from_fork(
-            repo, github_user, repo_dir, from_branch, to_branch, push_rebase
+    settings = {
+        "github_user": github_user,
+        "tmp_dir": tmp_dir,
+        "from_branch": from_branch,
+        "to_branch": to_branch,
+        "branches": branches,
+        "push_rebase": push_rebase,
+        "dry_run": dry_run,
+        "atomic_push": atomic_push,
+        "narrow": narrow,
+        # A rebase of an existing branch is only pushed by the full run
+        "precheck": not no_precheck and not push_rebase,
+        # A dry run does not push anything, its outcome is not recorded
+        "run_cache": None if no_run_cache or dry_run else RunCache("prupdate"),
+    }
+    # Repos are independent of each other, each one has its own workspace
+    if branches:
+        results = run_grouped(
+            lambda item: process_repo_branches(item[0], item[1], settings),
+            reposmap.items(),
+            jobs,
+        )
+        print_summary([row for rows in results for row in rows])
+    else:
+        results = run_grouped(
+            lambda item: process_repo(item[0], item[1], settings),
+            reposmap.items(),
+            jobs,
         )
+        print_summary(list(zip(reposmap, results)))
 
-        # # Step 2: Modify files in the .tekton folder
-        funcs = [
-            format_tekton_files,
-            update_tekton_files,
-            create_owners_file,
-            purge_tekton_files,
-        ]
-        # funcs = [format_tekton_files, update_tekton_files, create_owners_file]
-        messages = []
-        for func in funcs:
-            m = func(repo_dir, from_branch, to_branch, dry_run)
-            if m:
-                messages.append(m)
-
-        # Step 4: Check if a PR already exists for the branch
-        if not pr_exists(repo, from_branch, to_branch):
-            # If no PR exists, create one
-            create_pull_request(
-                repo, github_user, from_branch, to_branch, messages, owners, dry_run
-            )
+    print(get_client().scheduler.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+import threading
+
+from apps.konflux.workers import run
+
+
+# A queue of the branch updates to push. The updates are collected per workspace
+# and remote, and each group is sent with one git push of all its refspecs when
+# the queue is flushed, instead of one push (one SSH connection) per update. A
+# later update of the same branch replaces the earlier one. With atomic, the
+# updates of a group are all pushed or none of them is.
+class PushQueue:
+    def __init__(self, atomic=False):
+        self.atomic = atomic
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    # Function to queue the update of the branch of the remote to src (a local
+    # branch or a commit)
+    def add(self, repo_dir, remote, src, branch, force=False):
+        with self._lock:
+            group = self._groups.setdefault((repo_dir, remote), {})
+            group[branch] = f"{'+' if force else ''}{src}:refs/heads/{branch}"
+
+    # Function to push all queued updates, one git push per workspace and remote.
+    # Returns {(repo_dir, remote, branch): True if the branch was pushed}.
+    def flush(self, dry_run=False):
+        with self._lock:
+            groups, self._groups = self._groups, {}
+        pushed = {}
+        for (repo_dir, remote), refspecs in groups.items():
+            if dry_run:
+                print(f"DRY-RUN: Pushing changes to {', '.join(refspecs)}")
+                pushed.update({(repo_dir, remote, branch): True for branch in refspecs})
+                continue
+            done = self._push(repo_dir, remote, refspecs)
+            pushed.update(
+                {(repo_dir, remote, branch): branch in done for branch in refspecs}
+            )
+        return pushed
+
+    # Function to push a group of refspecs, returns the branches that were pushed
+    def _push(self, repo_dir, remote, refspecs):
+        args = ["git", "-C", repo_dir, "push", "--porcelain"]
+        if self.atomic:
+            args.append("--atomic")
+        result = run(
+            [*args, remote, *refspecs.values()], capture_output=True, text=True
+        )
+        print(result.stdout, end="")
+        if result.returncode != 0:
+            print(f"Error pushing to {remote} in {repo_dir}: {result.stderr}")
+        # The porcelain output has one "<flag>\t<src>:<dst>\t<summary>" line per
+        # ref, "!" is a rejected or failed update
+        done = set()
+        for line in result.stdout.splitlines():
+            fields = line.split("\t")
+            if len(fields) >= 2 and ":" in fields[1] and fields[0] != "!":
+                dst = fields[1].split(":", 1)[1]
+                done.add(dst.removeprefix("refs/heads/"))
+        return done
@@ -0,0 +1,132 @@
+import threading
+import time
+
+# GitHub asks to wait at least a second between mutating requests, and content
+# creating requests are limited to 80 per minute by the secondary rate limit
+DEFAULT_WRITE_RATE = 1.0
+MAX_WRITE_RATE = 80 / 60
+MIN_WRITE_RATE = 1 / 60
+# Wait for the reset instead of using the last primary rate limit requests
+DEFAULT_READ_RESERVE = 50
+# How long to wait after a secondary rate limit without Retry-After header
+SECONDARY_LIMIT_WAIT = 60
+
+
+# A token bucket, acquire() blocks until a token is available
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to take count tokens, returns how many seconds it waited for them
+    def acquire(self, count=1):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            wait = 0.0
+            if self.tokens < count:
+                wait = (count - self.tokens) / self.rate
+                time.sleep(wait)
+                self.updated = time.monotonic()
+                self.tokens = count
+            self.tokens -= count
+            return wait
+
+
+# Paces GitHub requests from the rate limit headers of the responses: mutating
+# requests go through a token bucket whose rate backs off on secondary rate
+# limits and slowly speeds up again, reads wait for the reset once the remaining
+# primary budget of their resource (core, graphql, search) runs low.
+class RateLimitScheduler:
+    def __init__(
+        self, write_rate=DEFAULT_WRITE_RATE, read_reserve=DEFAULT_READ_RESERVE
+    ):
+        self.writes = TokenBucket(write_rate)
+        self.read_reserve = read_reserve
+        # resource -> (remaining, reset epoch seconds)
+        self.budgets = {}
+        self.throttled = {"read": 0.0, "write": 0.0}
+        self.retries = 0
+        self._writes_since_backoff = 0
+        self._lock = threading.Lock()
+
+    def _count(self, kind, seconds):
+        with self._lock:
+            self.throttled[kind] += seconds
+
+    # Function to wait before sending a request, a write request making several
+    # writes at once (a batch of GraphQL mutations) costs one token per write
+    def before_request(self, write, resource="core", cost=1):
+        if write:
+            self._count("write", self.writes.acquire(cost))
+            return
+        with self._lock:
+            remaining, reset = self.budgets.get(resource, (None, 0))
+        if remaining is not None and remaining <= self.read_reserve:
+            wait = reset - time.time()
+            if wait > 0:
+                print(
+                    f"GitHub {resource} rate limit almost used up, waiting {wait:.0f}s for the reset."
+                )
+                time.sleep(wait)
+                self._count("read", wait)
+
+    # Function to record the rate limit headers of a response. Returns the number
+    # of seconds to wait before retrying the request, or None if it should not be retried.
+    def after_response(self, write, status_code, headers, message=""):
+        resource = headers.get("X-RateLimit-Resource", "core")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            with self._lock:
+                self.budgets[resource] = (int(remaining), int(reset))
+
+        if status_code not in (403, 429):
+            if write:
+                self._speed_up()
+            return None
+        if headers.get("Retry-After"):
+            wait = int(headers["Retry-After"])
+        elif remaining == "0" and reset is not None:
+            # The primary rate limit is used up
+            wait = max(int(reset) - time.time(), 1)
+        elif status_code == 429 or "secondary rate limit" in message.lower():
+            wait = SECONDARY_LIMIT_WAIT
+        else:
+            # A plain permission error
+            return None
+        if write:
+            self._back_off()
+        return wait
+
+    # Function to sleep before a retry, the time is counted as throttled
+    def wait_retry(self, write, wait):
+        print(f"Hit the GitHub rate limit, retrying in {wait:.0f}s.")
+        time.sleep(wait)
+        with self._lock:
+            self.retries += 1
+        self._count("write" if write else "read", wait)
+
+    def _back_off(self):
+        with self._lock:
+            self.writes.rate = max(self.writes.rate / 2, MIN_WRITE_RATE)
+            self._writes_since_backoff = 0
+
+    def _speed_up(self):
+        with self._lock:
+            self._writes_since_backoff += 1
+            if self._writes_since_backoff % 20 == 0:
+                self.writes.rate = min(self.writes.rate * 1.1, MAX_WRITE_RATE)
+
+    # Function to describe how long the run was throttled
+    def summary(self):
+        return (
+            f"GitHub rate limit: throttled reads {self.throttled['read']:.1f}s, "
+            f"writes {self.throttled['write']:.1f}s, retries {self.retries}"
+        )
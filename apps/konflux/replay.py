@@ -0,0 +1,61 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import click
+
+from apps.konflux.webhook import sign_payload
+
+
+# Function to load the recorded deliveries of a file, either one delivery
+# {"event": ..., "payload": {...}} or a list of them
+def load_deliveries(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    return data
+
+
+# Function to post one delivery to the webhook receiver the way GitHub does
+def send_delivery(url, event, payload, secret=None):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json", "X-GitHub-Event": event}
+    if secret:
+        headers["X-Hub-Signature-256"] = sign_payload(secret, body)
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+@click.command()
+@click.argument("files", nargs=-1, required=True)
+@click.option(
+    "--url",
+    type=click.STRING,
+    default="http://127.0.0.1:8080",
+    help="the URL of the prreview webhook receiver",
+)
+@click.option(
+    "--secret",
+    type=click.STRING,
+    envvar="PRREVIEW_WEBHOOK_SECRET",
+    help="the webhook secret used to sign the deliveries",
+)
+# Main function to replay recorded GitHub webhook deliveries against a local receiver
+# Example usage: python -m apps.konflux.replay --url=http://127.0.0.1:8080 events/pr-opened.json
+def main(files, url, secret):
+    for path in files:
+        for delivery in load_deliveries(path):
+            status = send_delivery(url, delivery["event"], delivery["payload"], secret)
+            print(
+                f"Replayed {delivery['event']} event from {os.path.basename(path)}: {status}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Function to compute the X-Hub-Signature-256 header of a webhook delivery
+def sign_payload(secret, body):
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+# Function to check the X-Hub-Signature-256 header, every delivery is accepted
+# without a secret, see WebhookServer
+def verify_signature(secret, body, signature):
+    if not secret:
+        return True
+    return hmac.compare_digest(sign_payload(secret, body), signature or "")
+
+
+# Function to check if a host only accepts connections from the local machine
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# A small GitHub webhook receiver. Deliveries are acknowledged right away and
+# handled one at a time by a worker thread calling handler(event, payload), so
+# GitHub never times out and two events of the same PR are never handled at once.
+class WebhookServer:
+    def __init__(self, handler, host="127.0.0.1", port=8080, secret=None):
+        # Without a secret anyone who can reach the receiver can trigger the
+        # handler, so only the local machine may reach it
+        if not secret and not is_loopback(host):
+            raise ValueError(f"a webhook secret is required to listen on {host}")
+        self.handler = handler
+        self.secret = secret
+        self.events = queue.Queue()
+        self.httpd = ThreadingHTTPServer((host, port), self._request_handler())
+        self._worker = threading.Thread(target=self._work, daemon=True)
+
+    def _request_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, text):
+                body = text.encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                signature = self.headers.get("X-Hub-Signature-256")
+                if not verify_signature(server.secret, body, signature):
+                    self._reply(401, "invalid signature")
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self._reply(400, "invalid payload")
+                    return
+                event = self.headers.get("X-GitHub-Event", "")
+                server.events.put((event, payload))
+                self._reply(202, "accepted")
+
+        return Handler
+
+    def _work(self):
+        while True:
+            event, payload = self.events.get()
+            try:
+                self.handler(event, payload)
+            except Exception as e:
+                print(f"Error handling {event} event: {e}")
+            finally:
+                self.events.task_done()
+
+    # Function to start the worker and serve deliveries until interrupted
+    def serve_forever(self):
+        self._worker.start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Listening for GitHub webhooks on http://{host}:{port}")
+        if not self.secret:
+            print(
+                "WARNING: no webhook secret is set, every delivery is accepted without verification"
+            )
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("Stopping the webhook server.")
+        finally:
+            self.httpd.server_close()
@@ -0,0 +1,96 @@
+import io
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Per-thread output buffer, set while a task runs in a worker thread
+_local = threading.local()
+_install_lock = threading.Lock()
+
+
+# A stdout wrapper that sends writes of worker threads to their own buffer, so the
+# output of concurrent tasks does not interleave
+class _ThreadRoutedStream:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        return getattr(_local, "buffer", None) or self._stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _install_router():
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadRoutedStream):
+            sys.stdout = _ThreadRoutedStream(sys.stdout)
+
+
+# Function to run func in the current thread and capture everything it prints
+def _run_captured(func, item):
+    _local.buffer = io.StringIO()
+    try:
+        result = func(item)
+        error = None
+    except Exception as e:
+        result = None
+        error = e
+    finally:
+        output = _local.buffer.getvalue()
+        _local.buffer = None
+    return result, error, output
+
+
+# Function to run func for every item with at most `jobs` worker threads.
+# The output of each item is printed as one block, in the order of items, so
+# logs read the same as a serial run. Returns the results in the order of items.
+def run_grouped(func, items, jobs=1):
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    _install_router()
+    results = []
+    first_error = None
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        futures = [executor.submit(_run_captured, func, item) for item in items]
+        for future in futures:
+            result, error, output = future.result()
+            sys.stdout.write(output)
+            if error and not first_error:
+                first_error = error
+            results.append(result)
+    if first_error:
+        raise first_error
+    return results
+
+
+# Drop-in replacement of subprocess.run: when called from a worker thread of
+# run_grouped, the output of the command is captured into the task's block
+# instead of being written straight to the terminal
+def run(args, **kwargs):
+    if getattr(_local, "buffer", None) is None or "stdout" in kwargs:
+        return subprocess.run(args, **kwargs)
+    if kwargs.pop("capture_output", False):
+        return subprocess.run(args, capture_output=True, **kwargs)
+
+    check = kwargs.pop("check", False)
+    kwargs.pop("stderr", None)
+    result = subprocess.run(
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs
+    )
+    output = result.stdout
+    if isinstance(output, bytes):
+        output = output.decode(errors="replace")
+    print(output, end="")
+    if check:
+        result.check_returncode()
+    return result
@@ -4,6 +4,12 @@ import click
 import shutil
 import subprocess
 
+from apps.common.gitmirror import (
+    clone_with_reference,
+    fetch_from_mirror,
+    update_mirror,
+)
+
 
 # Initialize YAML parser
 yaml = YAML()
@@ -113,9 +119,11 @@ def clone_repo_from_fork(
 ):
     # Construct the URL for the forked repository
     forked_repo_url = f"git@github.com:{fork_user}/{repo.split('/')[1]}.git"
+    # Update the local mirror of the upstream repo, the workspace borrows its objects
+    mirror = update_mirror(repo)
     if not os.path.exists(repo_dir):
         print(f"Cloning {forked_repo_url} into {repo_dir}...")
-        subprocess.run(["git", "clone", forked_repo_url, repo_dir], check=True)
+        clone_with_reference(forked_repo_url, repo_dir, mirror)
     # else:
     #     print(f"Repository {repo_dir} already exists. Pulling latest changes...")
     #     subprocess.run(['git', '-C', repo_dir, 'pull'], check=True)
@@ -124,7 +132,7 @@ def clone_repo_from_fork(
     original_repo_url = f"git@github.com:{repo}.git"
     check_upstream_remote(repo_dir, original_repo_url)
 
-    subprocess.run(["git", "-C", repo_dir, "fetch", "upstream"], check=True)
+    fetch_from_mirror(repo_dir, mirror)
 
     checkout_or_rebase_branch(
         repo_dir,
@@ -1,13 +1,19 @@
+import hashlib
+import io
 import os
-from ruamel.yaml import YAML
+from ruamel.yaml import YAML, __version__ as ruamel_yaml_version
 import click
 
+from apps.common.runcache import RunCache
+from apps.common.yamlcache import CanonicalYAMLCache
+
 
 # Initialize YAML parser
 yaml = YAML()
 yaml.preserve_quotes = True
 yaml.width = 4096
-yaml.indent(mapping=2, sequence=2, offset=0)
+yaml_indent = {"mapping": 2, "sequence": 2, "offset": 0}
+yaml.indent(**yaml_indent)
 
 test_steps = [
     "check",
@@ -38,9 +44,41 @@ def format_yaml_file(file_path):
         yaml.dump(data, f)
 
 
+# The cache of the YAML contents that skip_if_not_changed gives back unchanged,
+# created on first use
+canonical_cache = None
+
+
+# Function to get the cache of the YAML contents skip_if_not_changed does not
+# change. The steps and the value are part of the settings, so changing them
+# does not match the old entries.
+def get_canonical_cache():
+    global canonical_cache
+    if canonical_cache is None:
+        canonical_cache = CanonicalYAMLCache(
+            {
+                "preserve_quotes": yaml.preserve_quotes,
+                "width": yaml.width,
+                "indent": yaml_indent,
+                "ruamel_yaml": ruamel_yaml_version,
+                "test_steps": test_steps,
+                "skip_if_only_changed": skip_if_only_changed_value,
+            }
+        )
+    return canonical_cache
+
+
+# Function to set skip_if_only_changed on the test steps of a config file. Files
+# it is known to not change are skipped without the slow round trip, and the file
+# is only rewritten if it changed.
 def skip_if_not_changed(file_path):
+    cache = get_canonical_cache()
     with open(file_path, "r") as f:
-        data = yaml.load(f)
+        content = f.read()
+    if cache.is_canonical(content):
+        print(f"{file_path} is already up to date")
+        return
+    data = yaml.load(content)
 
     # Add or update the skip_if_only_changed in the tests element
     if "tests" in data:
@@ -57,9 +95,29 @@ def skip_if_not_changed(file_path):
                         f"Removed skip_if_only_changed in {file_path} for {test['as']}"
                     )
 
+    stream = io.StringIO()
+    yaml.dump(data, stream)
+    updated = stream.getvalue()
+    if updated == content:
+        cache.add(content)
+        return
+
     # Save changes to the YAML file
     with open(file_path, "w") as f:
-        yaml.dump(data, f)
+        f.write(updated)
+
+
+# Function to get a digest of the content of all .yaml files of a repo config dir
+def config_dir_digest(repo_config_dir):
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(repo_config_dir)):
+        for file_name in sorted(files):
+            if file_name.endswith(".yaml"):
+                file_path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(file_path, repo_config_dir).encode())
+                with open(file_path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
 
 
 def handle_one_repo(repo_config_dir):
@@ -82,9 +140,15 @@ def handle_one_repo(repo_config_dir):
     default="/Users/jiazhu/go/src/github.com/openshift/release",
     help="the local path to the openshift/release repo",
 )
+@click.option(
+    "--no-run-cache",
+    is_flag=True,
+    default=False,
+    help="set to true will process the repos even if their config did not change since the last run",
+)
 # Main function to configure acm repos skip tests if only non-code files change
 # Example usage: python -m apps.prow.skip_if_only_changed ocm,managedcluster-import-controller
-def main(repos, path):
+def main(repos, path, no_run_cache):
     # if repos is not provided, use the default list
     if not repos:
         repos = [
@@ -100,12 +164,27 @@ def main(repos, path):
 
     print(f"Repos: {repos}, Path: {path}")
 
+    # The config files of a repo are skipped if they are the same as after the
+    # last run with the same steps and value
+    run_cache = None if no_run_cache else RunCache("skip_if_only_changed")
+    config = {
+        "test_steps": test_steps,
+        "skip_if_only_changed": skip_if_only_changed_value,
+        "yaml": {"width": yaml.width, "indent": yaml_indent},
+    }
     for repo in repos:
         # repo folder path = path/ci-operator/config/stolostron/repo
         repo_config_dir = os.path.join(
             path, "ci-operator", "config", "stolostron", repo
         )
+        if run_cache and run_cache.get(
+            repo, config_dir_digest(repo_config_dir), config
+        ):
+            print(f"{repo_config_dir} did not change since the last run. Skipping...")
+            continue
         handle_one_repo(repo_config_dir)
+        if run_cache:
+            run_cache.put(repo, config_dir_digest(repo_config_dir), config, "updated")
 
 
 if __name__ == "__main__":